@@ -0,0 +1,95 @@
+"""Generates a synthetic video library to benchmark PyStream against.
+
+>>> library
+
+"""
+
+import argparse
+import os
+import pathlib
+from typing import Dict, List
+
+GIGABYTE = 1024 ** 3
+
+
+def sparse_file(path: pathlib.Path, size: int) -> None:
+    """Creates a sparse file of the given size, that takes no disk space until written to.
+
+    Args:
+        path: Path of the file.
+        size: Size of the file in bytes.
+    """
+    with open(path, "wb") as file:
+        file.truncate(size)
+
+
+def sample_video(path: pathlib.Path, seconds: int = 10, fps: int = 10) -> None:
+    """Creates a small, but decodable video file to benchmark preview generation.
+
+    Args:
+        path: Path of the video file.
+        seconds: Duration of the video.
+        fps: Frames per second.
+    """
+    import cv2
+    import numpy
+
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), fps, (640, 360))
+    for idx in range(seconds * fps):
+        writer.write(numpy.full((360, 640, 3), idx % 255, numpy.uint8))
+    writer.release()
+
+
+def generate(root: pathlib.Path,
+             directories: int = 1_000,
+             files_per_directory: int = 5,
+             large_files: int = 2,
+             large_file_size: int = 4 * GIGABYTE,
+             sample_videos: int = 5) -> Dict[str, List[str]]:
+    """Generates a synthetic library, reusing the files that already exist.
+
+    Args:
+        root: Root directory of the library, used as ``video_source``.
+        directories: Number of directories to create.
+        files_per_directory: Number of (empty) video files in each directory.
+        large_files: Number of sparse multi-GB files at the root of the library.
+        large_file_size: Size of each sparse file in bytes.
+        sample_videos: Number of decodable videos used to benchmark preview generation.
+
+    Returns:
+        Dict[str, List[str]]:
+        Returns the paths of the large files and sample videos, relative to the root.
+    """
+    root.mkdir(parents=True, exist_ok=True)
+    for dir_idx in range(directories):
+        directory = root / f"show_{dir_idx:05d}"
+        directory.mkdir(exist_ok=True)
+        for file_idx in range(files_per_directory):
+            (directory / f"episode_{file_idx:03d}.mp4").touch()
+    layout = {"large": [], "samples": []}
+    for idx in range(large_files):
+        path = root / f"large_{idx}.mp4"
+        if not path.exists() or path.stat().st_size != large_file_size:
+            sparse_file(path, large_file_size)
+        layout["large"].append(path.name)
+    samples = root / "samples"
+    samples.mkdir(exist_ok=True)
+    for idx in range(sample_videos):
+        path = samples / f"sample_{idx}.mp4"
+        if not path.exists():
+            sample_video(path)
+        layout["samples"].append(os.path.join(samples.name, path.name))
+    return layout
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic library for benchmarks")
+    parser.add_argument("root", type=pathlib.Path, help="Root directory of the library")
+    parser.add_argument("--directories", type=int, default=1_000)
+    parser.add_argument("--files-per-directory", type=int, default=5)
+    parser.add_argument("--large-files", type=int, default=2)
+    parser.add_argument("--large-file-size", type=int, default=4 * GIGABYTE)
+    parser.add_argument("--sample-videos", type=int, default=5)
+    args = parser.parse_args()
+    print(generate(args.root, args.directories, args.files_per_directory,
+                   args.large_files, args.large_file_size, args.sample_videos))
@@ -0,0 +1,362 @@
+"""Reproducible benchmark suite for PyStream, writes machine-readable results to compare across releases.
+
+>>> run
+
+See Also:
+    - Runs the server as a subprocess against a synthetic library generated by ``benchmarks/library.py``
+    - Measures range streaming throughput and latency under concurrent clients, listing latency vs library size,
+      preview generation rate and authentication overhead.
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import http.client
+import json
+import os
+import pathlib
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+import library  # noqa: E402
+
+import pystream  # noqa: E402
+from pystream.models import authenticator, config, images, secure  # noqa: E402
+
+USERNAME = "benchmark"
+PASSWORD = "benchmark-password"
+
+
+def percentile(samples: Sequence[float], pct: float) -> float:
+    """Returns the percentile of the samples using the nearest-rank method."""
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))]
+
+
+def summarize(samples: Sequence[float]) -> Dict[str, Union[int, float]]:
+    """Summarizes the latency samples (in seconds) into milliseconds.
+
+    Args:
+        samples: Latency samples in seconds.
+
+    Returns:
+        Dict[str, Union[int, float]]:
+        Returns the count, mean and percentiles of the samples.
+    """
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "mean_ms": round(sum(samples) / len(samples) * 1_000, 3),
+        "p50_ms": round(percentile(samples, 50) * 1_000, 3),
+        "p90_ms": round(percentile(samples, 90) * 1_000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1_000, 3),
+        "max_ms": round(max(samples) * 1_000, 3),
+    }
+
+
+def free_port() -> int:
+    """Returns a port number that is available to bind on localhost."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Server:
+    """Runs the streaming server in a subprocess for the duration of a benchmark.
+
+    >>> Server
+
+    """
+
+    def __init__(self,
+                 video_source: pathlib.Path,
+                 workdir: pathlib.Path,
+                 **env: str):
+        """Instantiates the server object.
+
+        Args:
+            video_source: Source directory for the server.
+            workdir: Working directory for the server process, where the logs are stored.
+            **env: Additional environment variables to configure the server.
+        """
+        self.port = free_port()
+        self.workdir = workdir
+        self.env = dict(os.environ,
+                        AUTHORIZATION=json.dumps({USERNAME: PASSWORD}),
+                        VIDEO_SOURCE=str(video_source),
+                        VIDEO_PORT=str(self.port),
+                        PYTHONPATH=str(pathlib.Path(__file__).parent.parent),
+                        **{key.upper(): value for key, value in env.items()})
+        self.process: Optional[subprocess.Popen] = None
+
+    def __enter__(self) -> "Server":
+        """Starts the server and waits until it accepts connections."""
+        log = open(self.workdir / f"server_{self.port}.log", "w")
+        self.process = subprocess.Popen(
+            [sys.executable, "-c", "import asyncio, pystream; asyncio.run(pystream.start())"],
+            env=self.env, cwd=self.workdir, stdout=log, stderr=subprocess.STDOUT
+        )
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {self.process.returncode}, refer {log.name!r}")
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+                return self
+            except OSError:
+                time.sleep(0.1)
+        raise TimeoutError("Server didn't start within 30 seconds")
+
+    def __exit__(self, *args) -> None:
+        """Stops the server."""
+        self.process.terminate()
+        self.process.wait(timeout=30)
+
+    def connection(self) -> http.client.HTTPConnection:
+        """Returns a new HTTP connection to the server."""
+        return http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+
+    def login(self) -> Tuple[str, float]:
+        """Logs in and returns the session cookie along with the time taken.
+
+        Returns:
+            Tuple[str, float]:
+            Returns the cookie header value and the latency in seconds.
+        """
+        timestamp = str(int(time.time()))
+        hex_user = asyncio.run(secure.hex_encode(USERNAME))
+        hex_pass = asyncio.run(secure.hex_encode(PASSWORD))
+        signature = hashlib.sha512(f"{hex_user}{hex_pass}{timestamp}".encode()).hexdigest()
+        authorization = base64.b64encode(f"{USERNAME},{signature},{timestamp}".encode()).decode()
+        conn = self.connection()
+        start = time.perf_counter()
+        conn.request("POST", config.static.login_endpoint, headers={"authorization": authorization})
+        response = conn.getresponse()
+        response.read()
+        elapsed = time.perf_counter() - start
+        conn.close()
+        if response.status != 200:
+            raise RuntimeError(f"Login failed with status {response.status}")
+        return response.getheader("set-cookie").split(";")[0], elapsed
+
+
+def timed_get(conn: http.client.HTTPConnection,
+              path: str,
+              headers: Dict[str, str],
+              read_size: int = 1024 * 1024) -> Tuple[int, int, float, float]:
+    """Makes a GET request and reads the whole body without holding on to it.
+
+    Args:
+        conn: HTTP connection to reuse.
+        path: Path to request.
+        headers: Request headers.
+        read_size: Size of each read from the socket.
+
+    Returns:
+        Tuple[int, int, float, float]:
+        Returns the status code, bytes received, time to first byte and total time taken.
+    """
+    start = time.perf_counter()
+    conn.request("GET", path, headers=headers)
+    response = conn.getresponse()
+    ttfb = time.perf_counter() - start
+    received = 0
+    while chunk := response.read(read_size):
+        received += len(chunk)
+    return response.status, received, ttfb, time.perf_counter() - start
+
+
+def bench_streaming(server: Server,
+                    cookie: str,
+                    files: List[str],
+                    file_size: int,
+                    clients: int,
+                    requests_per_client: int,
+                    range_size: int) -> Dict[str, Union[int, float, dict]]:
+    """Benchmarks range requests on the video endpoint from concurrent clients seeking at random.
+
+    Args:
+        server: Server to benchmark.
+        cookie: Session cookie.
+        files: Files to stream, relative to the library root.
+        file_size: Size of each file.
+        clients: Number of concurrent clients.
+        requests_per_client: Number of range requests made by each client.
+        range_size: Number of bytes requested in each range request.
+
+    Returns:
+        Dict[str, Union[int, float, dict]]:
+        Returns the throughput, time to first byte and latency of the range requests.
+    """
+    def client(seed: int) -> List[Tuple[int, int, float, float]]:
+        """Makes range requests at random offsets using a persistent connection."""
+        rand = random.Random(seed)
+        conn = server.connection()
+        results = []
+        for _ in range(requests_per_client):
+            file = rand.choice(files)
+            start = rand.randrange(0, file_size - range_size)
+            headers = {"cookie": cookie, "range": f"bytes={start}-{start + range_size - 1}"}
+            results.append(timed_get(conn, f"{config.static.streaming_endpoint}?file={file}", headers))
+        conn.close()
+        return results
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        results = [result for batch in executor.map(client, range(clients)) for result in batch]
+    elapsed = time.perf_counter() - start
+    received = sum(result[1] for result in results)
+    return {
+        "clients": clients,
+        "requests": len(results),
+        "errors": sum(1 for result in results if result[0] != 206),
+        "range_size": range_size,
+        "bytes": received,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_mib_s": round(received / elapsed / 1024 ** 2, 3),
+        "ttfb": summarize([result[2] for result in results]),
+        "latency": summarize([result[3] for result in results]),
+    }
+
+
+def bench_listing(server: Server, cookie: str, repeat: int) -> Dict[str, Union[int, dict]]:
+    """Benchmarks the latency of the home page listing.
+
+    Args:
+        server: Server to benchmark.
+        cookie: Session cookie.
+        repeat: Number of times to request the home page.
+
+    Returns:
+        Dict[str, Union[int, dict]]:
+        Returns the latency of the listing page.
+    """
+    conn = server.connection()
+    results = [timed_get(conn, config.static.home_endpoint, {"cookie": cookie}) for _ in range(repeat)]
+    conn.close()
+    return {
+        "errors": sum(1 for result in results if result[0] != 200),
+        "latency": summarize([result[3] for result in results]),
+    }
+
+
+def bench_previews(root: pathlib.Path, samples: List[str], workdir: pathlib.Path) -> Dict[str, Union[int, float]]:
+    """Benchmarks the rate at which preview images are generated.
+
+    Args:
+        root: Root directory of the library.
+        samples: Decodable video files relative to the root.
+        workdir: Directory to store the preview images.
+
+    Returns:
+        Dict[str, Union[int, float]]:
+        Returns the number of previews generated per second.
+    """
+    start = time.perf_counter()
+    generated = 0
+    for idx, sample in enumerate(samples):
+        if images.Images(filepath=root / sample).generate_preview(str(workdir / f"preview_{idx}.jpg")):
+            generated += 1
+    elapsed = time.perf_counter() - start
+    return {"previews": generated, "elapsed_s": round(elapsed, 3), "per_second": round(generated / elapsed, 3)}
+
+
+def bench_auth(server: Server, root: pathlib.Path, repeat: int) -> Dict[str, Union[float, dict]]:
+    """Benchmarks the login latency over HTTP, and the cost of validating a session token in-process.
+
+    Args:
+        server: Server to benchmark.
+        root: Root directory of the library.
+        repeat: Number of logins and token validations.
+
+    Returns:
+        Dict[str, Union[float, dict]]:
+        Returns the login latency and the number of token validations per second.
+    """
+    logins = [server.login()[1] for _ in range(repeat)]
+    config.env = config.EnvConfig(authorization={USERNAME: PASSWORD}, video_source=root)
+    config.session.mapping[USERNAME] = "benchmark-token"
+    payload = {"username": USERNAME, "token": "benchmark-token", "timestamp": int(time.time())}
+    token = config.static.cipher_suite.encrypt(str(payload).encode("utf-8")).decode()
+
+    async def validate() -> float:
+        """Validates the token repeatedly and returns the time taken."""
+        start = time.perf_counter()
+        for _ in range(repeat):
+            await authenticator.verify_token(token)
+        return time.perf_counter() - start
+
+    elapsed = asyncio.run(validate())
+    return {"login": summarize(logins), "token_validations_per_second": round(repeat / elapsed, 3)}
+
+
+def main() -> None:
+    """Parses the arguments and runs the benchmarks."""
+    parser = argparse.ArgumentParser(description="Benchmark PyStream against a synthetic library")
+    parser.add_argument("--root", type=pathlib.Path, default=pathlib.Path(tempfile.gettempdir()) / "pystream_bench",
+                        help="Directory to generate the synthetic libraries in")
+    parser.add_argument("--output", type=pathlib.Path, default=pathlib.Path("bench_results.json"),
+                        help="File to store the results in JSON format")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32],
+                        help="Number of concurrent range request clients")
+    parser.add_argument("--requests", type=int, default=50, help="Range requests per client")
+    parser.add_argument("--range-size", type=int, default=4 * 1024 * 1024, help="Bytes per range request")
+    parser.add_argument("--file-size", type=int, default=4 * library.GIGABYTE, help="Size of each sparse file")
+    parser.add_argument("--library-sizes", type=int, nargs="+", default=[100, 1_000, 10_000],
+                        help="Number of directories in each library used to benchmark the listing")
+    parser.add_argument("--repeat", type=int, default=20, help="Repetitions for listing and auth benchmarks")
+    args = parser.parse_args()
+
+    workdir = pathlib.Path(tempfile.mkdtemp(prefix="pystream_bench_"))
+    results = {
+        "meta": {
+            "version": pystream.version,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "timestamp": int(time.time()),
+            "arguments": {key: str(value) for key, value in vars(args).items()},
+        },
+        "streaming": [],
+        "listing": [],
+    }
+
+    for size in args.library_sizes:
+        root = args.root / f"library_{size}"
+        library.generate(root, directories=size, large_files=0, sample_videos=0)
+        with Server(root, workdir) as server:
+            cookie, _ = server.login()
+            results["listing"].append({"directories": size, **bench_listing(server, cookie, args.repeat)})
+        print(f"listing [{size} directories]: {results['listing'][-1]['latency']}")
+
+    root = args.root / "streaming"
+    layout = library.generate(root, directories=0, large_file_size=args.file_size)
+    with Server(root, workdir) as server:
+        cookie, _ = server.login()
+        for clients in args.clients:
+            results["streaming"].append(bench_streaming(server, cookie, layout["large"], args.file_size,
+                                                        clients, args.requests, args.range_size))
+            print(f"streaming [{clients} clients]: {results['streaming'][-1]['throughput_mib_s']} MiB/s, "
+                  f"p99 {results['streaming'][-1]['latency'].get('p99_ms')}ms")
+        results["auth"] = bench_auth(server, root, args.repeat)
+        print(f"auth: {results['auth']}")
+    results["previews"] = bench_previews(root, layout["samples"], workdir)
+    print(f"previews: {results['previews']}")
+
+    args.output.write_text(json.dumps(results, indent=2))
+    print(f"Results stored in {str(args.output)!r}")
+
+
+if __name__ == '__main__':
+    main()
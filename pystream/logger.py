@@ -1,7 +1,17 @@
+import atexit
+import contextvars
+import json
 import logging
+import logging.handlers
+import queue
+import time
+from typing import Dict, List, Optional, Tuple
 
 from uvicorn.logging import ColourizedFormatter
 
+# Client address for the request being served, set by the middleware so filters can rate limit per client
+client_host: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("client_host", default=None)
+
 
 class RootFilter(logging.Filter):
     """Class to initiate ``/`` filter in logs while preserving other access logs.
@@ -26,8 +36,148 @@ class RootFilter(logging.Filter):
             bool:
             False flag for the endpoint that needs to be filtered.
         """
-        return record.getMessage().find("/") == -1
+        # Access log format has a '/' in the template itself (HTTP/1.1), so the message needn't be formatted
+        if "/" in str(record.msg):
+            return False
+        return not any("/" in str(arg) for arg in (record.args if isinstance(record.args, tuple) else ()))
+
+
+class RateLimitFilter(logging.Filter):
+    """Class to rate limit repeated log messages from the same client.
+
+    >>> RateLimitFilter
+
+    See Also:
+        - Messages are grouped by the client address and the message template (before formatting).
+        - Records without a client (startup, shutdown, background tasks) and errors are never dropped.
+    """
+
+    def __init__(self, interval: float = 10):
+        """Instantiates the filter.
+
+        Args:
+            interval: Minimum number of seconds between messages with the same template from the same client.
+        """
+        super().__init__()
+        self.interval = interval
+        self.last_seen: Dict[Tuple[str, str], float] = {}
+
+    def filter(self,
+               record: logging.LogRecord) -> bool:
+        """Drops the record if the same client logged the same message within the interval.
+
+        Args:
+            record: ``LogRecord`` represents an event which is created every time something is logged.
+
+        Returns:
+            bool:
+            False flag if the record has to be dropped.
+        """
+        host = getattr(record, "client", None) or client_host.get()
+        if not host:
+            return True
+        # Stamp the client on the record, since the context is not available in the listener's thread
+        record.client = host
+        if not self.interval or record.levelno >= logging.ERROR:
+            return True
+        key = (host, str(record.msg))
+        now = time.monotonic()
+        if now - self.last_seen.get(key, 0) < self.interval:
+            return False
+        if len(self.last_seen) > 10_000:
+            self.last_seen = {k: v for k, v in self.last_seen.items() if now - v < self.interval}
+        self.last_seen[key] = now
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Formatter to write each log record as a single line of JSON.
+
+    >>> JsonFormatter
+
+    """
+
+    def format(self,
+               record: logging.LogRecord) -> str:
+        """Formats the record as a JSON string.
+
+        Args:
+            record: ``LogRecord`` represents an event which is created every time something is logged.
+
+        Returns:
+            str:
+            Returns the JSON string.
+        """
+        payload = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S%z"),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        if host := getattr(record, "client", None):
+            payload["client"] = host
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that hands over the record as-is, since the listener runs within the same process.
+
+    >>> LocalQueueHandler
+
+    See Also:
+        - ``QueueHandler.prepare`` formats the message and strips the arguments to make the record picklable.
+        - Skipping it moves the formatting off the event loop, and keeps the arguments for uvicorn's access formatter.
+    """
+
+    def prepare(self,
+                record: logging.LogRecord) -> logging.LogRecord:
+        """Returns the record without formatting it."""
+        return record
+
+
+def enqueue(*names: str) -> None:
+    """Moves the handlers of the given loggers behind a queue, so that the I/O happens in a separate thread.
+
+    Args:
+        *names: Names of the loggers.
+    """
+    for name in names:
+        logger_ = logging.getLogger(name)
+        handlers = [hdlr for hdlr in logger_.handlers if not isinstance(hdlr, logging.handlers.QueueHandler)]
+        if not handlers:
+            continue
+        for hdlr in handlers:
+            logger_.removeHandler(hdlr)
+        listener = logging.handlers.QueueListener(queue.SimpleQueue(), *handlers, respect_handler_level=True)
+        logger_.addHandler(LocalQueueHandler(listener.queue))
+        listener.start()
+        listeners.append(listener)
+
+
+def configure(json_format: bool = False, rate_limit: float = 10) -> None:
+    """Configures the output format and the rate limit for the application logs.
+
+    Args:
+        json_format: Boolean flag to write the logs as JSON.
+        rate_limit: Minimum number of seconds between repeated messages from the same client.
+    """
+    if json_format:
+        handler.setFormatter(fmt=JsonFormatter())
+    rate_limiter.interval = rate_limit
+
+
+def stop() -> None:
+    """Stops all the queue listeners, flushing the records that are pending."""
+    while listeners:
+        listeners.pop().stop()
+
 
+listeners: List[logging.handlers.QueueListener] = []
+atexit.register(stop)
 
 logging.getLogger("uvicorn.access").addFilter(RootFilter())
 
@@ -37,3 +187,6 @@ color_formatter = ColourizedFormatter(fmt="{levelprefix} [{module}:{lineno}] - {
 handler = logging.StreamHandler()
 handler.setFormatter(fmt=color_formatter)
 logger.addHandler(hdlr=handler)
+enqueue(logger.name)
+rate_limiter = RateLimitFilter()
+logger.handlers[0].addFilter(rate_limiter)
@@ -1,16 +1,32 @@
+import asyncio
+import contextlib
+import importlib.util
 import os
+import signal
+import socket
 import ssl
+import subprocess
+import sys
+import time
+from types import FrameType
+from typing import Dict, Iterator, List, Optional
 
 import uvicorn
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, RedirectResponse
 
+from pystream import logger as pylogger
 from pystream.logger import logger
-from pystream.models import config
+from pystream.models import (admission, cluster, config, images, remux, resume,
+                             scanner, search, tracing)
 from pystream.routers import auth, basics, video
 
+restarting = False
+timings: Dict[str, float] = {}
+tasks: List[asyncio.Task] = []
 app = FastAPI()
+app.add_middleware(tracing.TracingMiddleware)
 app.include_router(auth.router)
 app.include_router(basics.router)
 app.include_router(video.router)
@@ -50,10 +66,29 @@ async def startup_tasks() -> None:
     origins.extend(map((lambda x: x + '/*'), config.env.websites))
     # noinspection PyTypeChecker
     app.add_middleware(CORSMiddleware, allow_origins=origins, allow_methods=["GET", "POST"], allow_credentials=True)
+    tracing.Profiler.enabled = config.env.profile_requests
+    if hasattr(signal, "SIGUSR2"):
+        signal.signal(signal.SIGUSR2, tracing.toggle_profiler)
+    scanner.load()
+    scanner.listeners.append(search.refresh)
+    # Keep a reference to the task, as the event loop only holds a weak reference
+    tasks.append(asyncio.create_task(scanner.maintain()))
+    tasks.append(asyncio.create_task(resume.maintain()))
+    if node := cluster.setup():
+        node.handlers["preview"] = images.create_preview
+        node.handlers["remux"] = remux.create_remux
+        node.start()
 
 
 async def shutdown_tasks() -> None:
     """Tasks that need to run during the API shutdown."""
+    resume.flush()
+    if cluster.node:
+        cluster.node.stop()
+    # In a cluster, the files generated on the shared storage are still served by the other nodes
+    if config.env.preserve_files or restarting or cluster.node:
+        logger.info('Preserving %d files created during runtime.', len(config.static.deletions))
+        return
     logger.info('Deleting %d files created during runtime.', len(config.static.deletions))
     logger.debug(config.static.deletions)
     for file in config.static.deletions:
@@ -64,6 +99,148 @@ async def shutdown_tasks() -> None:
             logger.warning("File '%s' does not exist", file)
 
 
+@contextlib.contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Measures the time taken by a phase of the startup, to be included in the startup report.
+
+    Args:
+        name: Name of the phase.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = time.perf_counter() - started
+
+
+def report_startup() -> None:
+    """Logs the time taken by each phase of the startup, and the heavy modules that are loaded only on first use."""
+    logger.info("Server started in %.3fs [%s]", sum(timings.values()),
+                ", ".join(f"{name}: {elapsed:.3f}s" for name, elapsed in timings.items()))
+    deferred: List[str] = [module for module in ("cv2", "requests") if module not in sys.modules]
+    if deferred:
+        logger.info("Deferred imports until first use: %s", ", ".join(deferred))
+
+
+class Server(uvicorn.Server):
+    """Uvicorn server that stops admitting new streams as soon as the shutdown begins.
+
+    >>> Server
+
+    See Also:
+        - Uvicorn then stops accepting connections, and waits for the active ones until the ``drain_timeout``.
+    """
+
+    def handle_exit(self, sig: int, frame: Optional[FrameType]) -> None:
+        """Marks the server as draining before handing the signal over to uvicorn."""
+        admission.drain()
+        super().handle_exit(sig, frame)
+
+    async def startup(self, sockets: Optional[List[socket.socket]] = None) -> None:
+        """Starts listening for connections, and reports the time taken to start the server."""
+        with phase("listen"):
+            await super().startup(sockets=sockets)
+        report_startup()
+
+
+def listening_socket() -> Optional[socket.socket]:
+    """Get the socket to listen on, when it is inherited from a previous process or shared using ``SO_REUSEPORT``.
+
+    See Also:
+        - The server binds the socket itself when neither is configured.
+
+    Returns:
+        socket.socket:
+        Returns the listening socket.
+    """
+    if config.env.listen_fd is not None:
+        sock = socket.socket(fileno=config.env.listen_fd)
+        logger.info("Listening on inherited socket %s", sock.getsockname())
+        return sock
+    if config.env.reuse_port:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((config.env.video_host, config.env.video_port))
+        return sock
+
+
+def restart(sock: socket.socket) -> None:
+    """Starts a new process of the server that inherits the listening socket, and drains the current one.
+
+    Args:
+        sock: Listening socket to hand over.
+
+    See Also:
+        - New process accepts the connections right away, while the streams in progress finish in the current one.
+        - Files generated during runtime are preserved, since the new process continues to use them.
+    """
+    global restarting
+    if restarting:
+        return
+    restarting = True
+    logger.info("Handing over the listening socket to a new process")
+    sock.set_inheritable(True)
+    command = getattr(sys, "orig_argv", [sys.executable, *sys.argv])
+    subprocess.Popen(command, env=dict(os.environ, LISTEN_FD=str(sock.fileno())), pass_fds=(sock.fileno(),))
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+async def serve_hypercorn(sock: Optional[socket.socket] = None) -> None:
+    """Serves the API using ``hypercorn``, which speaks HTTP/2 and optionally HTTP/3 (QUIC) along with HTTP/1.1.
+
+    See Also:
+        - Previews, subtitles and ranges are multiplexed over a single connection, instead of several in parallel.
+        - Browsers negotiate HTTP/2 only over TLS, so ``cert_file`` and ``key_file`` are required to benefit from it.
+        - HTTP/3 listens on the same port over UDP, and is advertised to the browsers with the ``alt-svc`` header.
+        - Runs in the current process, so the ``workers`` setting is not applicable.
+
+    Args:
+        sock: Listening socket, if it is not to be bound by hypercorn.
+    """
+    try:
+        from hypercorn.asyncio import serve
+        from hypercorn.config import Config
+    except ImportError as error:
+        raise RuntimeWarning(
+            "'server' was set to 'hypercorn', however it is not installed. "
+            "Install it with: pip install 'stream-localhost[h2]'"
+        ) from error
+    if config.env.http3 and not importlib.util.find_spec("aioquic"):
+        raise RuntimeWarning(
+            "'http3' was set to True, however 'aioquic' is not installed. "
+            "Install it with: pip install 'stream-localhost[h3]'"
+        )
+    if config.env.workers > 1:
+        logger.warning("'workers' is not supported by hypercorn, serving from a single process")
+    hypercorn_config = Config()
+    hypercorn_config.bind = [f"{config.env.video_host}:{config.env.video_port}"]
+    hypercorn_config.graceful_timeout = config.env.drain_timeout
+    hypercorn_config.errorlog = logger
+    if config.env.cert_file and config.env.key_file:
+        hypercorn_config.certfile = str(config.env.cert_file)
+        hypercorn_config.keyfile = str(config.env.key_file)
+        if config.env.http3:
+            hypercorn_config.quic_bind = hypercorn_config.bind
+    else:
+        logger.warning("HTTP/2 is negotiated by browsers only over TLS, serving HTTP/1.1 without 'cert_file'")
+    if sock:
+        hypercorn_config.bind = [f"fd://{sock.fileno()}"]
+
+    shutdown = asyncio.Event()
+
+    def stop() -> None:
+        """Marks the server as draining and triggers hypercorn's graceful shutdown."""
+        admission.drain()
+        shutdown.set()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError):  # Signal handlers are not available in Windows' event loop
+            loop.add_signal_handler(sig, stop)
+    await serve(app, hypercorn_config, shutdown_trigger=shutdown.wait)
+
+
 async def start(**kwargs) -> None:
     """Starter function for the streaming API.
 
@@ -71,12 +248,18 @@ async def start(**kwargs) -> None:
         **kwargs: Keyword arguments to load the env config.
     """
     # Load and validate env vars/arguments
-    config.env = config.EnvConfig(**kwargs)
+    with phase("config"):
+        config.env = config.EnvConfig(**kwargs)
 
     # Configure uvicorn server with custom logging
+    started = time.perf_counter()
     log_config = uvicorn.config.LOGGING_CONFIG
     log_config["formatters"]["default"]["datefmt"] = "%Y-%m-%d %H:%M:%S"
     log_config["formatters"]["default"]["fmt"] = "%(asctime)s\t%(levelname)8s\t%(module)10s:%(lineno)d\t\t%(message)s"
+    if config.env.log_json:
+        log_config["formatters"]["default"] = {"()": "pystream.logger.JsonFormatter"}
+        log_config["formatters"]["access"] = {"()": "pystream.logger.JsonFormatter"}
+    pylogger.configure(json_format=config.env.log_json, rate_limit=config.env.log_rate_limit)
     # reload flag is set to false,
     #   1: reloading in the middle of streaming will make the process to wait for the connection to close
     #   2: connection will be open until the streaming stops (this is a circular dependency)
@@ -86,32 +269,55 @@ async def start(**kwargs) -> None:
         "port": config.env.video_port,
         "reload": False,
         "log_config": log_config,
-        "workers": config.env.workers
+        "workers": config.env.workers,
+        # Streams in progress are allowed to finish within this deadline, before the server exits
+        "timeout_graceful_shutdown": config.env.drain_timeout
     }
 
     if config.env.cert_file and config.env.key_file:  # Additional config for HTTPS
         argument_dict["ssl_keyfile"] = config.env.key_file
         argument_dict["ssl_certfile"] = config.env.cert_file
-        uvicorn_config = uvicorn.Config(**argument_dict)
     elif config.env.video_port == 443:
         raise RuntimeWarning(
             "'video_port' was set to 443, however 'cert_file' and 'key_file' are missing."
         )
-    else:
-        if config.env.secure_session:
-            logger.warning(
-                "Secure session is turned on! This means that the server can ONLY be hosted via HTTPS or localhost"
-            )
+    elif config.env.http3:
+        raise RuntimeWarning(
+            "'http3' was set to True, however 'cert_file' and 'key_file' are missing."
+        )
+    elif config.env.secure_session:
+        logger.warning(
+            "Secure session is turned on! This means that the server can ONLY be hosted via HTTPS or localhost"
+        )
+    if config.env.http3 and config.env.server != "hypercorn":
+        raise RuntimeWarning(
+            "'http3' was set to True, however it is only supported when 'server' is set to 'hypercorn'."
+        )
+
+    uvicorn_server = None
+    if config.env.server == "uvicorn":
         uvicorn_config = uvicorn.Config(**argument_dict)
-    uvicorn_server = uvicorn.Server(config=uvicorn_config)
+        # Logging is configured when the config is instantiated, so move the handlers behind a queue after that
+        pylogger.enqueue("uvicorn.error", "uvicorn.access")
+        uvicorn_server = Server(config=uvicorn_config)
+    timings["server"] = time.perf_counter() - started
 
     # Run startup tasks
     logger.info("Initiating startup tasks")
-    await startup_tasks()
+    with phase("startup tasks"):
+        await startup_tasks()
+
+    sock = listening_socket()
+    if sock and hasattr(signal, "SIGHUP"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, restart, sock)
 
-    # Await uvicorn server and handle SSL errors during startup
+    # Await the server and handle SSL errors during startup
     try:
-        await uvicorn_server.serve()
+        if uvicorn_server:
+            await uvicorn_server.serve(sockets=[sock] if sock else None)
+        else:
+            report_startup()
+            await serve_hypercorn(sock)
     except ssl.SSLError as error:
         logger.critical(error)
 
@@ -0,0 +1,126 @@
+import asyncio
+import math
+import time
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException, status
+
+from pystream.logger import logger
+from pystream.models import config, metrics
+
+
+class Ticket:
+    """Object to hold the slots acquired by an admitted stream, until the stream ends.
+
+    >>> Ticket
+
+    """
+
+    def __init__(self, semaphores: List[asyncio.Semaphore]):
+        """Instantiates the ticket with the acquired semaphores.
+
+        Args:
+            semaphores: List of semaphores that were acquired.
+        """
+        self.semaphores = semaphores
+
+    def release(self) -> None:
+        """Releases the slots, safe to call more than once."""
+        while self.semaphores:
+            self.semaphores.pop().release()
+
+
+async def acquire(semaphore: asyncio.Semaphore, deadline: float) -> bool:
+    """Acquires the semaphore, waiting in queue until the deadline if there are no free slots.
+
+    Args:
+        semaphore: Semaphore to acquire.
+        deadline: Monotonic time until which the request can wait.
+
+    Returns:
+        bool:
+        Returns a boolean flag to indicate whether the semaphore was acquired.
+    """
+    if not semaphore.locked():
+        await semaphore.acquire()
+        return True
+    metrics.streams_queued.inc()
+    try:
+        await asyncio.wait_for(semaphore.acquire(), timeout=max(0.0, deadline - time.monotonic()))
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        metrics.streams_queued.dec()
+
+
+async def admit(username: str) -> Ticket:
+    """Admits a new stream for the user if there are slots available within the configured limits.
+
+    Args:
+        username: Name of the user requesting the stream.
+
+    See Also:
+        - The user's slot is acquired before the global slot, so a user waiting on their own limit doesn't hold on to
+          a global slot that another user could have used.
+
+    Raises:
+        HTTPException:
+        503 Service Unavailable with ``Retry-After`` header, if a slot couldn't be acquired before the timeout, or if
+        the server is draining.
+
+    Returns:
+        Ticket:
+        Returns the ticket that should be released when the stream ends.
+    """
+    global total
+    if draining:
+        metrics.streams_rejected.inc()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is shutting down, please try again.",
+            headers={"Retry-After": "1"}
+        )
+    semaphores = []
+    if config.env.max_user_streams:
+        if username not in users:
+            users[username] = asyncio.Semaphore(config.env.max_user_streams)
+        semaphores.append(users[username])
+    if config.env.max_streams:
+        if total is None:
+            total = asyncio.Semaphore(config.env.max_streams)
+        semaphores.append(total)
+    ticket = Ticket([])
+    deadline = time.monotonic() + config.env.stream_queue_timeout
+    for semaphore in semaphores:
+        try:
+            acquired = await acquire(semaphore, deadline)
+        except BaseException:
+            # Request was cancelled while waiting (client disconnected), the slots held so far must not leak
+            ticket.release()
+            raise
+        if not acquired:
+            ticket.release()
+            metrics.streams_rejected.inc()
+            logger.warning("Rejected stream for '%s', server is at capacity", username)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many active streams, please try again later.",
+                headers={"Retry-After": str(max(1, math.ceil(config.env.stream_queue_timeout)))}
+            )
+        ticket.semaphores.append(semaphore)
+    metrics.streams_admitted.inc()
+    return ticket
+
+
+def drain() -> None:
+    """Stops admitting new streams, while the streams in progress continue until they end or the server exits."""
+    global draining
+    if not draining:
+        draining = True
+        logger.info("Draining, new streams will be rejected")
+
+
+users: Dict[str, asyncio.Semaphore] = {}
+total: Optional[asyncio.Semaphore] = None
+draining = False
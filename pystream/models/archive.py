@@ -0,0 +1,369 @@
+import hashlib
+import os
+import pathlib
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import AsyncIterable, ByteString, Callable, List, Optional, Tuple
+from urllib import parse as urlparse
+
+from fastapi import HTTPException, status
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+
+from pystream.logger import logger
+from pystream.models import (admission, config, handles, metrics, stream,
+                             throttle)
+
+# General purpose flags: sizes and CRC follow the data in a descriptor (bit 3), names are UTF-8 (bit 11)
+FLAGS = 0x0808
+VERSION = 45  # ZIP64
+ZIP64_LIMIT = 0xFFFFFFFF
+
+
+def dos_timestamp(mtime: float) -> Tuple[int, int]:
+    """Converts the modified time to the MS-DOS time and date used in the headers, which can't go before 1980.
+
+    Args:
+        mtime: Modified time of the file in seconds since epoch.
+
+    Returns:
+        Tuple[int, int]:
+        Returns the time and the date.
+    """
+    t = time.localtime(max(mtime, 315532800))
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+class Entry:
+    """File within the archive, along with the offsets of its parts.
+
+    >>> Entry
+
+    """
+
+    __slots__ = ("path", "name", "size", "mtime_ns", "timestamp", "offset", "header")
+
+    def __init__(self, path: str, name: str, stat: os.stat_result, offset: int):
+        """Builds the local header of the file.
+
+        Args:
+            path: Path of the file.
+            name: Name of the file within the archive.
+            stat: Stat result of the file.
+            offset: Offset of the local header within the archive.
+        """
+        self.path = path
+        self.name = name.encode()
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.timestamp = dos_timestamp(stat.st_mtime_ns / 1e9)
+        self.offset = offset
+        # Sizes are known upfront for stored files, so they are included in the ZIP64 extra field as well
+        extra = struct.pack("<HHQQ", 0x0001, 16, self.size, self.size)
+        self.header = struct.pack(
+            "<IHHHHHIIIHH", 0x04034b50, VERSION, FLAGS, 0, *self.timestamp, 0,
+            ZIP64_LIMIT, ZIP64_LIMIT, len(self.name), len(extra)
+        ) + self.name + extra
+
+    @property
+    def key(self) -> Tuple[str, int, int]:
+        """Identifies the version of the file, for its checksum to be cached."""
+        return self.path, self.mtime_ns, self.size
+
+    @property
+    def data_offset(self) -> int:
+        """Offset of the file's content within the archive."""
+        return self.offset + len(self.header)
+
+    @property
+    def descriptor_offset(self) -> int:
+        """Offset of the data descriptor, which follows the file's content."""
+        return self.data_offset + self.size
+
+    def descriptor(self, crc: int) -> bytes:
+        """Get the data descriptor with the checksum and the sizes of the file."""
+        return struct.pack("<IIQQ", 0x08074b50, crc, self.size, self.size)
+
+    def central_header(self, crc: int) -> bytes:
+        """Get the central directory header of the file."""
+        extra = struct.pack("<HHQQQ", 0x0001, 24, self.size, self.size, self.offset)
+        return struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014b50, (3 << 8) | VERSION, VERSION, FLAGS, 0,
+            *self.timestamp, crc, ZIP64_LIMIT, ZIP64_LIMIT, len(self.name), len(extra), 0, 0, 0,
+            0o100644 << 16, ZIP64_LIMIT
+        ) + self.name + extra
+
+
+DESCRIPTOR_SIZE = 24
+CENTRAL_HEADER_SIZE = 46 + 28
+
+
+class Layout:
+    """Layout of a stored (uncompressed) ZIP64 archive of a directory, computed from the sizes of the files alone.
+
+    >>> Layout
+
+    See Also:
+        - Every byte offset is known before any file is read, so the archive can be served in ranges and resumed.
+        - Checksums are written in the data descriptors and the central directory, once they're known.
+    """
+
+    def __init__(self, directory: pathlib.Path):
+        """Walks the directory and computes the offsets of each part of the archive.
+
+        Args:
+            directory: Directory to archive.
+
+        See Also:
+            - Hidden files, files that start with ``_`` and directories that end with ``__`` are left out.
+        """
+        self.entries: List[Entry] = []
+        offset = 0
+        for path, dirs, files in os.walk(directory):
+            dirs.sort()
+            if path.endswith('__'):
+                continue
+            for file_ in sorted(files):
+                if file_.startswith('_') or file_.startswith('.'):
+                    continue
+                filepath = os.path.join(path, file_)
+                try:
+                    stat = os.stat(filepath)
+                except OSError:
+                    continue
+                name = os.path.relpath(filepath, directory.parent).replace(os.path.sep, "/")
+                entry = Entry(filepath, name, stat, offset)
+                self.entries.append(entry)
+                offset = entry.descriptor_offset + DESCRIPTOR_SIZE
+        self.central_offset = offset
+        self.central_size = sum(CENTRAL_HEADER_SIZE + len(entry.name) for entry in self.entries)
+        end_offset = self.central_offset + self.central_size
+        self.end = struct.pack(
+            "<IQHHIIQQQQ", 0x06064b50, 44, VERSION, VERSION, 0, 0,
+            len(self.entries), len(self.entries), self.central_size, self.central_offset
+        ) + struct.pack("<IIQI", 0x07064b50, 0, end_offset, 1) + struct.pack(
+            "<IHHHHIIH", 0x06054b50, 0, 0, 0xFFFF, 0xFFFF, ZIP64_LIMIT, ZIP64_LIMIT, 0
+        )
+        self.size = end_offset + len(self.end)
+        digest = hashlib.sha256()
+        for entry in self.entries:
+            digest.update(b"%s\0%d\0%d\0" % (entry.name, entry.size, entry.mtime_ns))
+        self.etag = f'"{digest.hexdigest()[:32]}"'
+
+
+def checksum(file_handle: handles.Handle, size: int) -> int:
+    """Computes the CRC-32 for the first few bytes of a file, reading it in chunks.
+
+    Args:
+        file_handle: Pooled handle of the file.
+        size: Number of bytes to include.
+
+    Returns:
+        int:
+        Returns the checksum.
+    """
+    crc = 0
+    offset = 0
+    while offset < size:
+        chunk = file_handle.read(offset, min(config.static.chunk_size, size - offset))
+        if not chunk:
+            raise OSError(f"{file_handle.name!r} was truncated while it was being archived")
+        crc = zlib.crc32(chunk, crc)
+        offset += len(chunk)
+    return crc
+
+
+def get_crc(entry: Entry) -> Optional[int]:
+    """Get the cached checksum of a file."""
+    with _lock:
+        if (crc := crcs.get(entry.key)) is not None:
+            crcs.move_to_end(entry.key)
+        return crc
+
+
+def put_crc(entry: Entry, crc: int) -> None:
+    """Caches the checksum of a file, evicting the least recently used ones beyond ``MAX_CRCS``."""
+    with _lock:
+        crcs[entry.key] = crc
+        while len(crcs) > MAX_CRCS:
+            crcs.popitem(last=False)
+
+
+async def send_archive(layout: Layout,
+                       start_range: int,
+                       end_range: int,
+                       file_name: str = "",
+                       username: str = "",
+                       on_close: Optional[Callable[[], None]] = None) -> AsyncIterable[ByteString]:
+    """Generates the requested range of the archive, reading the files through the handle pool.
+
+    Args:
+        layout: Layout of the archive.
+        start_range: Start of range.
+        end_range: End of range.
+        file_name: Name of the archive used to tag the metrics.
+        username: Name of the user downloading the archive, used to tag the metrics and apply bandwidth limits.
+        on_close: Callback to release the admission ticket when the download ends.
+
+    See Also:
+        - Memory is bound by the chunk size, as the files are read and sent one chunk at a time.
+        - Checksums are computed on the fly and cached, so a later range of the same archive reuses them.
+        - A range that starts within a file, reads the part before it only when its checksum isn't cached.
+
+    Yields:
+        ByteString:
+        Bytes as iterable.
+    """
+    buckets = throttle.get_buckets(username)
+    sizer = stream.ChunkSizer()
+    stream.ChunkSizer.active += 1
+    metrics.active_streams.inc()
+    start = time.perf_counter()
+
+    def clip(offset: int, length: int) -> Tuple[int, int]:
+        """Get the part of a segment within the requested range, relative to the segment."""
+        return max(start_range, offset) - offset, min(end_range + 1, offset + length) - offset
+
+    async def send(chunk: ByteString) -> ByteString:
+        """Applies the bandwidth limits and records the metrics before a chunk is sent."""
+        await throttle.consume(buckets, len(chunk))
+        metrics.bytes_streamed.inc(len(chunk), file=file_name, user=username)
+        metrics.chunk_bytes.observe(len(chunk))
+        return chunk
+
+    pool = handles.get_pool()
+    checksums: List[Optional[int]] = [None] * len(layout.entries)
+    try:
+        for index, entry in enumerate(layout.entries):
+            if entry.descriptor_offset + DESCRIPTOR_SIZE <= start_range and end_range < layout.central_offset:
+                continue
+            if entry.offset > end_range:
+                break
+            low, high = clip(entry.offset, len(entry.header))
+            if low < high:
+                yield await send(entry.header[low:high])
+            crc = checksums[index] = get_crc(entry)
+            # Checksum is needed only if the range reaches the data descriptor or the central directory
+            running = None if crc is not None or end_range < entry.descriptor_offset else 0
+            low, high = clip(entry.data_offset, entry.size)
+            if running is None and low >= high:
+                continue
+            file_handle = await run_in_threadpool(pool.acquire, entry.path)
+            try:
+                if (file_handle.stat.st_mtime_ns, file_handle.stat.st_size) != (entry.mtime_ns, entry.size):
+                    raise OSError(f"{entry.path!r} was modified while it was being archived")
+                if running is not None:
+                    running = await run_in_threadpool(checksum, file_handle, min(low, entry.size))
+                offset = low
+                while offset < high:
+                    read_size = min(sizer.size, high - offset)
+                    with metrics.chunk_read.time():
+                        chunk = await run_in_threadpool(file_handle.read, offset, read_size)
+                    if not chunk:
+                        raise OSError(f"{entry.path!r} was truncated while it was being archived")
+                    if running is not None:
+                        running = zlib.crc32(chunk, running)
+                    offset += len(chunk)
+                    sent_at = time.perf_counter()
+                    yield await send(chunk)
+                    sizer.update(len(chunk), time.perf_counter() - sent_at)
+            finally:
+                pool.release(file_handle)
+            if running is not None:
+                crc = checksums[index] = running
+                put_crc(entry, crc)
+            low, high = clip(entry.descriptor_offset, DESCRIPTOR_SIZE)
+            if low < high:
+                yield await send(entry.descriptor(crc)[low:high])
+        low, high = clip(layout.central_offset, layout.central_size)
+        if low < high:
+            # Checksums of every file are known by now, as the range reaches the central directory
+            central = b"".join(entry.central_header(crc) for entry, crc in zip(layout.entries, checksums))
+            yield await send(central[low:high])
+        low, high = clip(layout.central_offset + layout.central_size, len(layout.end))
+        if low < high:
+            yield await send(layout.end[low:high])
+    except OSError as error:
+        # Headers are already sent, so the only option is to end the response short for the client to detect it
+        logger.error("Failed to archive '%s': %s", file_name, error)
+    finally:
+        if on_close:
+            on_close()
+        stream.ChunkSizer.active -= 1
+        metrics.active_streams.dec()
+        metrics.range_duration.observe(time.perf_counter() - start)
+
+
+def archive_response(layout: Layout,
+                     file_name: str,
+                     range_header: Optional[str] = None,
+                     if_range: Optional[str] = None,
+                     username: str = "",
+                     ticket: Optional[admission.Ticket] = None) -> stream.BufferStreamingResponse:
+    """Returns a streaming response with the archive, or the requested range of it.
+
+    Args:
+        layout: Layout of the archive.
+        file_name: Name of the archive to download as.
+        range_header: Range values from the headers.
+        if_range: Entity tag from the ``If-Range`` header, to serve the range only if the archive is unchanged.
+        username: Name of the user downloading the archive.
+        ticket: Admission ticket that is released when the download ends.
+
+    Returns:
+        BufferStreamingResponse:
+        Streaming response from fastapi.
+    """
+    released = False
+
+    def release() -> None:
+        """Releases the admission ticket, only once for each request."""
+        nonlocal released
+        if not released:
+            released = True
+            if ticket:
+                ticket.release()
+
+    headers = {
+        "content-type": "application/zip",
+        "content-disposition": f"attachment; filename*=UTF-8''{urlparse.quote(file_name)}",
+        "accept-ranges": "bytes",
+        "content-length": str(layout.size),
+        "etag": layout.etag,
+    }
+    start_range = 0
+    end_range = layout.size - 1
+    status_code = status.HTTP_200_OK
+    # Files changed since the download began, so the whole archive is sent again
+    if range_header and (not if_range or if_range == layout.etag):
+        try:
+            start_range, end_range = stream.get_range_header(range_header=range_header, file_size=layout.size)
+        except HTTPException:
+            release()
+            raise
+        headers["content-length"] = str(end_range - start_range + 1)
+        headers["content-range"] = f"bytes {start_range}-{end_range}/{layout.size}"
+        status_code = status.HTTP_206_PARTIAL_CONTENT
+
+    metrics.range_requests.inc(file=file_name)
+    return stream.BufferStreamingResponse(
+        content=send_archive(layout=layout,
+                             start_range=start_range,
+                             end_range=end_range,
+                             file_name=file_name,
+                             username=username,
+                             on_close=release),
+        headers=headers,
+        status_code=status_code,
+        background=BackgroundTask(release)
+    )
+
+
+MAX_CRCS = 4096
+_lock = threading.Lock()
+crcs: "OrderedDict[Tuple[str, int, int], int]" = OrderedDict()
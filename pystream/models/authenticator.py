@@ -4,24 +4,41 @@ from typing import Dict, List, NoReturn, Union
 
 from cryptography.fernet import InvalidSignature, InvalidToken
 from fastapi import HTTPException, Request, status
+from fastapi.security import HTTPBasic
 from pydantic import ValidationError
 
 from pystream.logger import logger
-from pystream.models import config, secure, squire
+from pystream.models import cluster, config, metrics, secure, squire
 
+basic_auth = HTTPBasic(auto_error=False)
 
-async def failed_auth_counter(request: Request) -> None:
+
+async def failed_auth_counter(request: Request) -> int:
     """Keeps track of failed login attempts from each host, and redirects if failed for 3 or more times.
 
     Args:
         request: Takes the ``Request`` object as an argument.
+
+    Returns:
+        int:
+        Returns the number of failed attempts from the host.
     """
-    try:
-        config.session.invalid[request.client.host] += 1
-    except KeyError:
-        config.session.invalid[request.client.host] = 1
-    if config.session.invalid[request.client.host] >= 3:
+    attempts = await cluster.offload(cluster.increment, config.session.invalid, request.client.host)
+    if attempts >= 3:
         raise config.RedirectException(location="/error")
+    return attempts
+
+
+def store_session(host: str, username: str, key: str) -> None:
+    """Resets the failed login attempts from the host, and stores the session token for the user.
+
+    Args:
+        host: Host that logged in.
+        username: Name of the user.
+        key: Session token generated for the user.
+    """
+    config.session.invalid[host] = 0
+    config.session.mapping[username] = key
 
 
 async def extract_credentials(request: Request) -> List[str]:
@@ -38,8 +55,9 @@ async def extract_credentials(request: Request) -> List[str]:
 
 async def raise_error(request) -> NoReturn:
     """Raises a 401 Unauthorized error in case of bad credentials."""
-    await failed_auth_counter(request)
-    logger.error("Incorrect username or password: %d", config.session.invalid[request.client.host])
+    attempts = await failed_auth_counter(request)
+    metrics.auth_failures.inc(reason="credentials")
+    logger.error("Incorrect username or password: %d", attempts)
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Incorrect username or password",
@@ -64,30 +82,62 @@ async def verify_login(request: Request) -> Dict[str, Union[str, int]]:
     message = f"{hex_user}{hex_pass}{timestamp}"
     expected_signature = await secure.calculate_hash(message)
     if secrets.compare_digest(signature, expected_signature):
-        config.session.invalid[request.client.host] = 0
         key = squire.keygen()
         # Store session token for each apikey
-        config.session.mapping[username] = key
+        await cluster.offload(store_session, request.client.host, username, key)
         return {"username": username, "token": key, "timestamp": int(timestamp)}
     await raise_error(request)
 
 
-async def verify_token(token: str) -> None:
+async def verify_token(token: str) -> config.WebToken:
     """Decrypts the symmetric encrypted token and validates the session token and expiration.
 
     Args:
         token: Symmetric encrypted key.
+
+    Returns:
+        WebToken:
+        Returns the decoded payload of the session token.
     """
     if not token:
         logger.warning("Session token was missing/revoked")
+        metrics.auth_failures.inc(reason="missing")
         raise config.RedirectException(location="/error", detail="Invalid session token")
     try:
         decoded = config.WebToken(**eval(config.static.cipher_suite.decrypt(token).decode()))
     except (InvalidToken, InvalidSignature, ValidationError) as error:
         logger.error(type(error))
+        metrics.auth_failures.inc(reason="invalid")
         raise config.RedirectException(location="/error", detail="Invalid session token")
-    if not secrets.compare_digest(decoded.token, config.session.mapping.get(decoded.username, '')):
+    session_key = await cluster.offload(config.session.mapping.get, decoded.username, '')
+    if not secrets.compare_digest(decoded.token, session_key):
+        metrics.auth_failures.inc(reason="invalid")
         raise config.RedirectException(location="/error", detail="Invalid session token")
     # Max time and expiry for session token is set in the Cookie, but this is a fallback mechanism to avoid tampering
     if time.time() - decoded.timestamp > config.env.session_duration:
+        metrics.auth_failures.inc(reason="expired")
         raise config.RedirectException(location="/error", detail="Session expired")
+    return decoded
+
+
+async def verify_basic_auth(request: Request) -> str:
+    """Verifies the username and password sent via basic authentication, used by clients that can't log in.
+
+    Args:
+        request: Takes the ``Request`` object as an argument.
+
+    Returns:
+        str:
+        Returns the username of the authenticated user.
+    """
+    credentials = await basic_auth(request)
+    if not credentials:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Basic"}
+        )
+    password = config.env.authorization.get(credentials.username)
+    if password and secrets.compare_digest(credentials.password.encode(), password.get_secret_value().encode()):
+        return credentials.username
+    await raise_error(request)
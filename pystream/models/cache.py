@@ -0,0 +1,119 @@
+import collections
+import threading
+from typing import Hashable, Optional, OrderedDict, Tuple
+
+from pystream.models import config, handles, metrics
+
+
+class BlockCache:
+    """Shared cache of fixed-size, aligned blocks read from the video files, evicted in least recently used order.
+
+    >>> BlockCache
+
+    See Also:
+        - Blocks are keyed by the file's path, modified time and size, so a replaced file never serves stale blocks.
+        - Reads happen in the threadpool, hence the lock around the bookkeeping (not around the disk reads).
+    """
+
+    def __init__(self,
+                 capacity: int,
+                 block_size: int):
+        """Instantiates the cache.
+
+        Args:
+            capacity: Maximum number of bytes to hold in memory.
+            block_size: Size of each block in bytes, blocks are aligned to multiples of this size in the file.
+        """
+        self.capacity = capacity
+        self.block_size = block_size
+        self.blocks: OrderedDict[Tuple[Hashable, int], bytes] = collections.OrderedDict()
+        self.size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[Hashable, int]) -> Optional[bytes]:
+        """Get a block from the cache, marking it as most recently used.
+
+        Args:
+            key: File identifier and the index of the block.
+
+        Returns:
+            bytes:
+            Returns the block if it is cached.
+        """
+        with self._lock:
+            block = self.blocks.get(key)
+            if block is not None:
+                self.blocks.move_to_end(key)
+            return block
+
+    def put(self, key: Tuple[Hashable, int], block: bytes) -> None:
+        """Adds a block to the cache, evicting the least recently used blocks to stay within the capacity.
+
+        Args:
+            key: File identifier and the index of the block.
+            block: Block of bytes read from the file.
+        """
+        if len(block) > self.capacity:
+            return
+        with self._lock:
+            if key in self.blocks:
+                return
+            self.blocks[key] = block
+            self.size += len(block)
+            while self.size > self.capacity:
+                _, evicted = self.blocks.popitem(last=False)
+                self.size -= len(evicted)
+                metrics.cache_evictions.inc()
+            metrics.cache_bytes.set(self.size)
+
+    def read(self,
+             file_handle: handles.Handle,
+             file_key: Hashable,
+             offset: int,
+             size: int) -> bytes:
+        """Reads a range of bytes from the file, serving the blocks from the cache where possible.
+
+        Args:
+            file_handle: Handle to read the missing blocks from.
+            file_key: Unique identifier for the file.
+            offset: Position in the file to start reading from.
+            size: Number of bytes to read.
+
+        Returns:
+            bytes:
+            Returns the bytes read, fewer than the size requested only at the end of the file.
+        """
+        pieces = []
+        end = offset + size
+        while offset < end:
+            index, skip = divmod(offset, self.block_size)
+            key = (file_key, index)
+            block = self.get(key)
+            if block is None:
+                metrics.cache_misses.inc()
+                block = file_handle.read(index * self.block_size, self.block_size)
+                self.put(key, block)
+            else:
+                metrics.cache_hits.inc()
+            piece = block[skip:skip + end - offset]
+            if not piece:
+                break
+            pieces.append(piece)
+            offset += len(piece)
+        return pieces[0] if len(pieces) == 1 else b"".join(pieces)
+
+
+def get_cache() -> Optional[BlockCache]:
+    """Get the block cache, instantiated on first use as per the env config.
+
+    Returns:
+        BlockCache:
+        Returns the block cache if it is enabled.
+    """
+    global store
+    if store is None and config.env.cache_size:
+        store = BlockCache(capacity=config.env.cache_size, block_size=config.static.chunk_size)
+    return store
+
+
+store: Optional[BlockCache] = None
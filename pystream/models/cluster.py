@@ -0,0 +1,493 @@
+import asyncio
+import bisect
+import hashlib
+import json
+import pathlib
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import (Any, Callable, Dict, Iterator, List, MutableMapping,
+                    Optional, Protocol, Set, Tuple)
+
+from cryptography.fernet import Fernet
+from starlette.concurrency import run_in_threadpool
+
+from pystream.logger import logger
+from pystream.models import config
+
+
+class Backend(Protocol):
+    """Key-value protocol for the state shared across the nodes, values must be JSON serializable.
+
+    >>> Backend
+
+    """
+
+    def get(self, namespace: str, key: str) -> Any:
+        """Returns the value stored for the key, raises ``KeyError`` when it is missing."""
+
+    def put(self, namespace: str, key: str, value: Any) -> None:
+        """Stores the value for the key, overwriting the existing value."""
+
+    def add(self, namespace: str, key: str, value: Any) -> bool:
+        """Stores the value only if the key is missing, returns a boolean flag to indicate whether it was stored."""
+
+    def delete(self, namespace: str, key: str) -> bool:
+        """Deletes the key, returns a boolean flag to indicate whether it existed."""
+
+    def increment(self, namespace: str, key: str) -> int:
+        """Increments the integer stored for the key (missing keys start at zero) atomically, returns the new value."""
+
+    def keys(self, namespace: str) -> List[str]:
+        """Returns all the keys stored in the namespace."""
+
+
+class MemoryBackend:
+    """In-process implementation of the backend protocol, for a single node or to stub the shared storage.
+
+    >>> MemoryBackend
+
+    """
+
+    def __init__(self):
+        """Instantiates the backend with an empty store."""
+        self.store: Dict[str, Dict[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: str) -> Any:
+        """Returns the value stored for the key, raises ``KeyError`` when it is missing."""
+        with self._lock:
+            return json.loads(self.store.get(namespace, {})[key])
+
+    def put(self, namespace: str, key: str, value: Any) -> None:
+        """Stores the value for the key, overwriting the existing value."""
+        with self._lock:
+            self.store.setdefault(namespace, {})[key] = json.dumps(value)
+
+    def add(self, namespace: str, key: str, value: Any) -> bool:
+        """Stores the value only if the key is missing, returns a boolean flag to indicate whether it was stored."""
+        with self._lock:
+            space = self.store.setdefault(namespace, {})
+            if key in space:
+                return False
+            space[key] = json.dumps(value)
+            return True
+
+    def delete(self, namespace: str, key: str) -> bool:
+        """Deletes the key, returns a boolean flag to indicate whether it existed."""
+        with self._lock:
+            return self.store.get(namespace, {}).pop(key, None) is not None
+
+    def increment(self, namespace: str, key: str) -> int:
+        """Increments the integer stored for the key (missing keys start at zero) atomically, returns the new value."""
+        with self._lock:
+            space = self.store.setdefault(namespace, {})
+            value = json.loads(space.get(key, "0")) + 1
+            space[key] = json.dumps(value)
+            return value
+
+    def keys(self, namespace: str) -> List[str]:
+        """Returns all the keys stored in the namespace."""
+        with self._lock:
+            return list(self.store.get(namespace, {}))
+
+
+class SQLiteBackend:
+    """SQLite implementation of the backend protocol, for a database file on the storage shared by all the nodes.
+
+    >>> SQLiteBackend
+
+    See Also:
+        - Uses the rollback journal instead of WAL, since WAL relies on shared memory that network filesystems lack.
+        - Each statement is committed on its own, so the writes are visible to the other nodes right away.
+    """
+
+    def __init__(self, filepath: pathlib.Path):
+        """Opens (or creates) the database.
+
+        Args:
+            filepath: Path of the database file.
+        """
+        self.connection = sqlite3.connect(str(filepath), timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=DELETE")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS state "
+            "(namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (namespace, key))"
+        )
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: str) -> Any:
+        """Returns the value stored for the key, raises ``KeyError`` when it is missing."""
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT value FROM state WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def put(self, namespace: str, key: str, value: Any) -> None:
+        """Stores the value for the key, overwriting the existing value."""
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO state (namespace, key, value) VALUES (?, ?, ?)",
+                (namespace, key, json.dumps(value))
+            )
+
+    def add(self, namespace: str, key: str, value: Any) -> bool:
+        """Stores the value only if the key is missing, returns a boolean flag to indicate whether it was stored."""
+        with self._lock:
+            cursor = self.connection.execute(
+                "INSERT OR IGNORE INTO state (namespace, key, value) VALUES (?, ?, ?)",
+                (namespace, key, json.dumps(value))
+            )
+        return cursor.rowcount > 0
+
+    def delete(self, namespace: str, key: str) -> bool:
+        """Deletes the key, returns a boolean flag to indicate whether it existed."""
+        with self._lock:
+            cursor = self.connection.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+        return cursor.rowcount > 0
+
+    def increment(self, namespace: str, key: str) -> int:
+        """Increments the integer stored for the key (missing keys start at zero) atomically, returns the new value.
+
+        See Also:
+            - Read and write happen within an immediate transaction, which holds the database's write lock for all
+              the nodes, so concurrent increments are never lost.
+        """
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute(
+                    "SELECT value FROM state WHERE namespace = ? AND key = ?", (namespace, key)
+                ).fetchone()
+                value = (json.loads(row[0]) if row else 0) + 1
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO state (namespace, key, value) VALUES (?, ?, ?)",
+                    (namespace, key, json.dumps(value))
+                )
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+        return value
+
+    def keys(self, namespace: str) -> List[str]:
+        """Returns all the keys stored in the namespace."""
+        with self._lock:
+            rows = self.connection.execute("SELECT key FROM state WHERE namespace = ?", (namespace,)).fetchall()
+        return [row[0] for row in rows]
+
+
+class SharedDict(MutableMapping):
+    """Dictionary view over a namespace of the shared backend, used in place of the in-memory session dicts.
+
+    >>> SharedDict
+
+    See Also:
+        - Reads can be cached in memory for ``ttl`` seconds, so that a lookup for every request doesn't hit the backend.
+        - Writes from the current node invalidate the cache, while writes from the other nodes show up after the TTL.
+    """
+
+    def __init__(self, namespace: str, backend: Backend, ttl: float = 0):
+        """Instantiates the view.
+
+        Args:
+            namespace: Namespace of the keys in the backend.
+            backend: Backend that stores the values.
+            ttl: Number of seconds to cache the values (and missing keys) read from the backend.
+        """
+        self.namespace = namespace
+        self.backend = backend
+        self.ttl = ttl
+        self._cache: Dict[str, Tuple[float, Any]] = {}
+
+    def __getitem__(self, key: str) -> Any:
+        """Returns the value stored for the key."""
+        if self.ttl and (cached := self._cache.get(key)) and time.monotonic() - cached[0] < self.ttl:
+            if cached[1] is KeyError:
+                raise KeyError(key)
+            return cached[1]
+        try:
+            value = self.backend.get(self.namespace, key)
+        except KeyError:
+            value = KeyError
+        if self.ttl:
+            self._cache[key] = (time.monotonic(), value)
+        if value is KeyError:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        """Stores the value for the key."""
+        self._cache.pop(key, None)
+        self.backend.put(self.namespace, key, value)
+
+    def __delitem__(self, key: str) -> None:
+        """Deletes the key."""
+        self._cache.pop(key, None)
+        if not self.backend.delete(self.namespace, key):
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterates over the keys."""
+        return iter(self.backend.keys(self.namespace))
+
+    def __len__(self) -> int:
+        """Returns the number of keys."""
+        return len(self.backend.keys(self.namespace))
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        """Stores the default only if the key is missing, atomically across the nodes, and returns the stored value."""
+        self._cache.pop(key, None)
+        self.backend.add(self.namespace, key, default)
+        return self[key]
+
+    def increment(self, key: str) -> int:
+        """Increments the integer stored for the key atomically across the nodes, and returns the new value."""
+        self._cache.pop(key, None)
+        return self.backend.increment(self.namespace, key)
+
+
+class HashRing:
+    """Consistent hash ring to assign work to the nodes, so that each item is processed by only one of them.
+
+    >>> HashRing
+
+    See Also:
+        - Each node is placed at several points on the ring, to spread the items evenly.
+        - When a node joins or leaves, only the items on its share of the ring move to another node.
+    """
+
+    def __init__(self, nodes: List[str], replicas: int = 64):
+        """Places the nodes on the ring.
+
+        Args:
+            nodes: Names of the nodes.
+            replicas: Number of points on the ring for each node.
+        """
+        self.nodes = sorted(nodes)
+        points = sorted((self.hash(f"{node}#{index}"), node) for node in self.nodes for index in range(replicas))
+        self.points = [point for point, _ in points]
+        self.owners = [node for _, node in points]
+
+    @staticmethod
+    def hash(key: str) -> int:
+        """Returns a stable hash of the key, which is the same on all the nodes unlike python's ``hash``."""
+        # SHA-256 instead of MD5, since MD5 is not available on FIPS enabled hosts
+        return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], "big")
+
+    def owner(self, key: str) -> str:
+        """Returns the node that owns the key.
+
+        Args:
+            key: Identifier of the work item.
+
+        Returns:
+            str:
+            Returns the name of the node.
+        """
+        index = bisect.bisect(self.points, self.hash(key)) % len(self.points)
+        return self.owners[index]
+
+
+class Cluster:
+    """Object to store the state of the node in a cluster, and to dispatch the work items to their owners.
+
+    >>> Cluster
+
+    See Also:
+        - Nodes announce themselves with a heartbeat, and the ring is rebuilt whenever the live nodes change.
+        - Work for another node is queued in the shared backend, and picked up by the owner's background task.
+        - Claimed work runs on a pool of ``cluster_workers`` threads, so a long remux never delays the heartbeats that
+          keep the node in the ring.
+    """
+
+    HEARTBEAT = 5
+    NODES = "nodes"
+    JOBS = "jobs"
+
+    def __init__(self, node: str, backend: Backend):
+        """Instantiates the cluster state for the node.
+
+        Args:
+            node: Name of the current node, unique across the cluster.
+            backend: Backend shared by all the nodes.
+        """
+        self.node = node
+        self.backend = backend
+        self.ring = HashRing([node])
+        self.handlers: Dict[str, Callable[[str], Any]] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.running: Set[str] = set()
+
+    def heartbeat(self) -> None:
+        """Announces the node as alive and rebuilds the ring with the nodes that are alive."""
+        now = time.time()
+        self.backend.put(self.NODES, self.node, now)
+        alive = [self.node]
+        for node in self.backend.keys(self.NODES):
+            if node == self.node:
+                continue
+            try:
+                if now - self.backend.get(self.NODES, node) < self.HEARTBEAT * 3:
+                    alive.append(node)
+            except KeyError:
+                continue
+        if sorted(alive) != self.ring.nodes:
+            logger.info("Cluster nodes: %s", sorted(alive))
+            self.ring = HashRing(alive)
+
+    def owns(self, key: str) -> bool:
+        """Returns a boolean flag to indicate whether the current node owns the key."""
+        return self.ring.owner(key) == self.node
+
+    def dispatch(self, kind: str, key: str) -> bool:
+        """Decides where a work item runs, queueing it for its owner when that is another node.
+
+        Args:
+            kind: Type of the work, as registered in the handlers.
+            key: Identifier of the work item, passed to the handler.
+
+        Returns:
+            bool:
+            Returns a boolean flag to indicate whether the current node should process the item.
+        """
+        owner = self.ring.owner(key)
+        if owner == self.node:
+            return True
+        self.backend.put(self.JOBS, f"{kind}:{key}", owner)
+        return False
+
+    def claim(self) -> List[str]:
+        """Removes the queued work items owned by the current node from the backend, and returns them."""
+        claimed = []
+        for job in self.backend.keys(self.JOBS):
+            try:
+                if self.backend.get(self.JOBS, job) != self.node:
+                    continue
+            except KeyError:
+                continue
+            if self.backend.delete(self.JOBS, job):
+                claimed.append(job)
+        return claimed
+
+    def run(self, job: str) -> None:
+        """Runs a claimed work item with its handler, logging the failures as nobody waits on the result.
+
+        Args:
+            job: Work item as queued, in the form of ``kind:key``.
+        """
+        kind, key = job.split(":", 1)
+        try:
+            if handler := self.handlers.get(kind):
+                handler(key)
+            else:
+                logger.warning("No handler registered for '%s' work", kind)
+        except Exception as error:
+            logger.error("Failed to process '%s': %s", job, error)
+        finally:
+            self.running.discard(job)
+
+    def submit(self, jobs: List[str]) -> None:
+        """Submits the claimed work items to the pool, skipping the ones that are already running."""
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=config.env.cluster_workers, thread_name_prefix="cluster")
+        for job in jobs:
+            if job not in self.running:
+                self.running.add(job)
+                self.executor.submit(self.run, job)
+
+    async def maintain(self) -> None:
+        """Background task to send heartbeats and hand the work queued for the current node to the pool."""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.heartbeat)
+                self.submit(await loop.run_in_executor(None, self.claim))
+            except Exception as error:
+                logger.error("Cluster maintenance failed: %s", error)
+            await asyncio.sleep(self.HEARTBEAT)
+
+    def start(self) -> None:
+        """Starts the background task in the running event loop."""
+        self.task = asyncio.create_task(self.maintain())
+
+    def stop(self) -> None:
+        """Cancels the background task, and removes the node from the cluster so its work moves to the others."""
+        if self.task:
+            self.task.cancel()
+        if self.executor:
+            self.executor.shutdown(wait=False)
+        self.backend.delete(self.NODES, self.node)
+
+
+def setup() -> Optional[Cluster]:
+    """Moves the sessions and the session token's key to the shared backend, when a cluster state is configured.
+
+    Returns:
+        Cluster:
+        Returns the cluster state for the current node, if enabled.
+    """
+    global node
+    if not config.env.cluster_state:
+        return
+    backend = SQLiteBackend(config.env.cluster_state)
+    # Session tokens are validated for every request, so the lookups are cached briefly
+    config.session.mapping = SharedDict("mapping", backend, ttl=2)
+    config.session.invalid = SharedDict("invalid", backend)
+    # Session tokens are encrypted with the same key on all the nodes, so they're valid on any node
+    key = SharedDict("secrets", backend).setdefault("fernet", Fernet.generate_key().decode())
+    config.static.cipher_suite = Fernet(key.encode())
+    node = Cluster(config.env.node_name, backend)
+    node.heartbeat()
+    logger.info("Joined the cluster as '%s' using '%s'", node.node, config.env.cluster_state)
+    return node
+
+
+async def offload(func: Callable, *args: Any) -> Any:
+    """Calls a function that accesses the session store, in the threadpool when the store is shared.
+
+    Args:
+        func: Function to call.
+        *args: Arguments for the function.
+
+    See Also:
+        - The shared backend can wait up to 30 seconds on a lock held by another node, which must not block the loop.
+    """
+    if node:
+        return await run_in_threadpool(func, *args)
+    return func(*args)
+
+
+def increment(store: MutableMapping, key: str) -> int:
+    """Increments the counter stored for the key, atomically across the nodes when the store is shared.
+
+    Args:
+        store: Session store with the counters.
+        key: Key of the counter.
+
+    Returns:
+        int:
+        Returns the incremented value.
+    """
+    if isinstance(store, SharedDict):
+        return store.increment(key)
+    store[key] = store.get(key, 0) + 1
+    return store[key]
+
+
+async def dispatch(kind: str, key: str) -> bool:
+    """Returns a boolean flag to indicate whether the current node should process the item, always true standalone.
+
+    Args:
+        kind: Type of the work, as registered in the handlers.
+        key: Identifier of the work item.
+    """
+    return await run_in_threadpool(node.dispatch, kind, key) if node else True
+
+
+node: Optional[Cluster] = None
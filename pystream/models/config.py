@@ -3,7 +3,8 @@ import os
 import pathlib
 import socket
 from ipaddress import IPv4Address
-from typing import Any, Dict, List, Optional, Sequence, Set, Tuple, Union
+from typing import (Any, Dict, List, Literal, Optional, Sequence, Set, Tuple,
+                    Union)
 
 from cryptography.fernet import Fernet
 from pydantic import (BaseModel, DirectoryPath, Field, FilePath, PositiveInt,
@@ -43,10 +44,15 @@ class EnvConfig(BaseSettings):
     authorization: Any
     video_source: DirectoryPath
 
-    video_host: IPv4Address = socket.gethostbyname("localhost")
+    # Resolved when the config is loaded, instead of when the module is imported
+    video_host: IPv4Address = Field(default_factory=lambda: socket.gethostbyname("localhost"))
     video_port: PositiveInt = 8000
     session_duration: int = Field(default=3_600, ge=300)  # Defaults to 1 hour, should at least be 5 minutes
     file_formats: Sequence[str] = (".mov", ".mp4")
+    remux_formats: Sequence[str] = ()
+    ffmpeg: str = "ffmpeg"
+    ffprobe: str = "ffprobe"
+    max_remuxes: PositiveInt = 2
 
     workers: int = Field(1, le=os.cpu_count(), ge=1, env="WORKERS")
     websites: Union[List[str], None] = []
@@ -54,6 +60,55 @@ class EnvConfig(BaseSettings):
     key_file: Union[FilePath, None] = None
     cert_file: Union[FilePath, None] = None
     secure_session: bool = False
+    server: Literal["uvicorn", "hypercorn"] = "uvicorn"
+    http3: bool = False
+
+    drain_timeout: PositiveInt = 30
+    reuse_port: bool = False
+    listen_fd: Union[int, None] = None
+    preserve_files: bool = False
+
+    cluster_state: Union[pathlib.Path, None] = None
+    node_name: str = Field(default_factory=socket.gethostname)
+    cluster_workers: PositiveInt = 2
+
+    stream_bandwidth: Union[PositiveInt, None] = None
+    user_bandwidth: Union[PositiveInt, None] = None
+    total_bandwidth: Union[PositiveInt, None] = None
+
+    stream_mode: Literal["read", "mmap"] = "read"
+    adaptive_chunks: bool = True
+    min_chunk_size: PositiveInt = 64 * 1024
+    chunk_budget: PositiveInt = 256 * 1024 * 1024
+    cache_size: int = Field(0, ge=0)
+    read_ahead: int = Field(4, ge=0)
+    file_handles: PositiveInt = 64
+    stat_ttl: float = Field(1, ge=0)
+    sidecar_ttl: float = Field(30, ge=0)
+    scan_interval: PositiveInt = 300
+    scan_ttl: float = Field(10, ge=0)
+    scan_workers: PositiveInt = 16
+    scan_snapshot: Union[pathlib.Path, None] = None
+    preview_workers: PositiveInt = 2
+
+    live_window: float = Field(0, ge=0)
+
+    resume_store: Union[pathlib.Path, None] = None
+    resume_flush: PositiveInt = 15
+
+    max_streams: Union[PositiveInt, None] = None
+    max_user_streams: Union[PositiveInt, None] = None
+    stream_queue_timeout: float = Field(5, ge=0)
+
+    log_json: bool = False
+    log_rate_limit: float = Field(10, ge=0)
+
+    server_timing: bool = True
+    slow_request: Union[PositiveInt, None] = None
+    profile_requests: bool = False
+    profile_sample_rate: float = Field(0.1, gt=0, le=1)
+    profile_threshold: PositiveInt = 1_000
+    profile_dir: pathlib.Path = pathlib.Path("profiles")
 
     class Config:
         """Environment variables configuration."""
@@ -125,10 +180,15 @@ class Static(BaseModel):
     track: str = "track"
     stream: str = "stream"
     preview: str = "preview"
+    download: str = "download"
     query_param: str = "file"
     home_endpoint: str = "/home"
     login_endpoint: str = "/login"
     logout_endpoint: str = "/logout"
+    metrics_endpoint: str = "/metrics"
+    search_endpoint: str = "/search"
+    posters_endpoint: str = "/posters"
+    heartbeat_endpoint: str = "/heartbeat"
     streaming_endpoint: str = "/video"
     chunk_size: PositiveInt = 1024 * 1024
     deletions: Set[pathlib.PosixPath] = set()
@@ -150,6 +210,7 @@ class Session(BaseModel):
     info: dict = {}
     invalid: dict = {}
     mapping: dict = {}
+    playback: dict = {}
 
 
 class WebToken(BaseModel):
@@ -0,0 +1,157 @@
+import collections
+import os
+import threading
+import time
+from typing import Optional, OrderedDict, Tuple
+
+from pystream.models import config, metrics
+
+
+class Handle:
+    """Open file descriptor along with the stat result it was opened against.
+
+    >>> Handle
+
+    See Also:
+        - Reads use ``pread``, which doesn't move a shared file position, so concurrent streams can share the handle.
+    """
+
+    __slots__ = ("name", "fd", "stat", "checked", "refs", "retired", "_lock")
+
+    def __init__(self, name: str, fd: int, stat: os.stat_result):
+        """Instantiates the handle.
+
+        Args:
+            name: Path of the file.
+            fd: Open file descriptor.
+            stat: Stat result of the file when it was opened.
+        """
+        self.name = name
+        self.fd = fd
+        self.stat = stat
+        self.checked = time.monotonic()
+        self.refs = 0
+        self.retired = False
+        self._lock = threading.Lock()
+
+    @property
+    def key(self) -> Tuple[str, int, int]:
+        """Unique identifier for the file's content, using the path, modified time and size."""
+        return self.name, self.stat.st_mtime_ns, self.stat.st_size
+
+    def fileno(self) -> int:
+        """Returns the file descriptor."""
+        return self.fd
+
+    def read(self, offset: int, size: int) -> bytes:
+        """Reads the bytes at the given offset.
+
+        Args:
+            offset: Position in the file to start reading from.
+            size: Number of bytes to read.
+
+        Returns:
+            bytes:
+            Returns the bytes read.
+        """
+        if hasattr(os, "pread"):
+            return os.pread(self.fd, size, offset)
+        with self._lock:  # Fallback for platforms without pread
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            return os.read(self.fd, size)
+
+
+class HandlePool:
+    """Bounded pool of open file handles, evicted in least recently used order.
+
+    >>> HandlePool
+
+    See Also:
+        - Stat results are reused for ``stat_ttl`` seconds, after which the file is stat-ed again.
+        - Handle is replaced when the file's modified time or size changes, so a replaced file is never served stale.
+        - Evicted or replaced handles are closed only after the streams using them release them.
+    """
+
+    def __init__(self, capacity: int, stat_ttl: float):
+        """Instantiates the pool.
+
+        Args:
+            capacity: Maximum number of idle handles to keep open.
+            stat_ttl: Number of seconds to reuse the stat result for.
+        """
+        self.capacity = capacity
+        self.stat_ttl = stat_ttl
+        self.handles: OrderedDict[str, Handle] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, path: str) -> Handle:
+        """Get an open handle for the file, opening it if it is not pooled or if it has changed.
+
+        Args:
+            path: Path of the file.
+
+        Returns:
+            Handle:
+            Returns the handle with its reference count incremented.
+        """
+        with self._lock:
+            handle = self.handles.get(path)
+            if handle and time.monotonic() - handle.checked < self.stat_ttl:
+                self.handles.move_to_end(path)
+                handle.refs += 1
+                metrics.handle_hits.inc()
+                return handle
+        # Syscalls are made outside the lock, as they can be slow on network filesystems
+        stat = os.stat(path)
+        with self._lock:
+            handle = self.handles.get(path)
+            if handle and (handle.stat.st_mtime_ns, handle.stat.st_size) == (stat.st_mtime_ns, stat.st_size):
+                handle.checked = time.monotonic()
+                self.handles.move_to_end(path)
+                handle.refs += 1
+                metrics.handle_hits.inc()
+                return handle
+        metrics.handle_misses.inc()
+        fd = os.open(path, os.O_RDONLY)
+        new = Handle(path, fd, os.fstat(fd))
+        new.refs += 1
+        with self._lock:
+            if (stale := self.handles.pop(path, None)) is not None:
+                self._retire(stale)
+            self.handles[path] = new
+            while len(self.handles) > self.capacity:
+                self._retire(self.handles.popitem(last=False)[1])
+        return new
+
+    def release(self, handle: Handle) -> None:
+        """Decrements the reference count, closing the handle if it was retired from the pool.
+
+        Args:
+            handle: Handle acquired from the pool.
+        """
+        with self._lock:
+            handle.refs -= 1
+            if handle.retired and handle.refs <= 0:
+                os.close(handle.fd)
+
+    def _retire(self, handle: Handle) -> None:
+        """Marks the handle as no longer pooled, closing it right away if it is not in use."""
+        handle.retired = True
+        if handle.refs <= 0:
+            os.close(handle.fd)
+
+
+def get_pool() -> HandlePool:
+    """Get the handle pool, instantiated on first use as per the env config.
+
+    Returns:
+        HandlePool:
+        Returns the handle pool.
+    """
+    global pool
+    if pool is None:
+        pool = HandlePool(capacity=config.env.file_handles, stat_ttl=config.env.stat_ttl)
+    return pool
+
+
+pool: Optional[HandlePool] = None
@@ -1,11 +1,20 @@
+import base64
 import datetime
 import os
 import pathlib
-from typing import Tuple
-
-import cv2
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from urllib import parse as urlparse
 
 from pystream.logger import logger
+from pystream.models import cluster, config, metrics, statcache
+
+# Widths of the poster renditions, the largest one is also used for the JPEG fallback
+POSTER_WIDTHS = (320, 640, 1280)
+# Efficient formats in the order of preference, browsers pick the first one they support
+POSTER_TYPES = {".avif": "image/avif", ".webp": "image/webp"}
+POSTER_QUALITY = {".avif": 50, ".webp": 75, ".jpg": 80}
 
 
 class Images:
@@ -13,6 +22,9 @@ class Images:
 
     >>> Images
 
+    See Also:
+        - ``cv2`` is imported within the methods, as importing it takes a while and it's only required when previews
+          are generated.
     """
 
     def __init__(self,
@@ -22,6 +34,7 @@ class Images:
         Args:
             filepath: Path of the video file.
         """
+        import cv2
         self.filepath = filepath
         self.video_capture = cv2.VideoCapture(str(self.filepath))
 
@@ -38,6 +51,8 @@ class Images:
             bool:
             Returns a boolean flag to indicate success/failure.
         """
+        import cv2
+
         # todo: put it to use integrating with 'video-js'
         if output_dir and output_dir.exists():
             path = str(output_dir)
@@ -69,6 +84,7 @@ class Images:
             Tuple[int, datetime.timedelta]:
             A tuple of seconds and the timedelta value.
         """
+        import cv2
         frames = self.video_capture.get(cv2.CAP_PROP_FRAME_COUNT)
         fps = self.video_capture.get(cv2.CAP_PROP_FPS)
         seconds = round(frames / fps)
@@ -88,6 +104,14 @@ class Images:
             bool:
             Returns a boolean flag to indicate success/failure.
         """
+        with metrics.preview_generation.time():
+            return self._generate_preview(path, at_second)
+
+    def _generate_preview(self,
+                          path: str,
+                          at_second: int = None) -> bool:
+        """Captures the frame at the given second and stores it as the preview image."""
+        import cv2
         seconds, video_time = self.get_video_length()
         if at_second:
             assert at_second <= seconds, f"Frame at {at_second}s is beyond the video duration of {seconds}s"
@@ -102,8 +126,206 @@ class Images:
         self.video_capture.set(cv2.CAP_PROP_POS_MSEC, at_second * 1_000)
         success, image = self.video_capture.read()
         if success:
-            cv2.imwrite(path, image)  # save frame as JPEG file
+            write_posters(image, path)
             logger.info("Generated preview image for '%s' [%s] at %d seconds",
                         self.filepath.name, video_time, at_second)
             return True
         logger.error("Failed to generate preview image for '%s' [%s]", self.filepath.name, video_time)
+
+
+def write_posters(image, path: str) -> None:
+    """Stores the frame as poster renditions, resized to each of the ``POSTER_WIDTHS`` in the efficient formats.
+
+    Args:
+        image: Frame captured from the video.
+        path: Path of the JPEG fallback, which is written last so that its presence marks the renditions as complete.
+
+    See Also:
+        - Frames are only downsized, widths larger than the frame are skipped, except for the smallest one.
+        - AVIF is written only when the ``cv2`` build has an encoder for it.
+        - Every file is registered for deletion as it is written, whether or not a browser ever requests it.
+    """
+    import cv2
+    params = {".avif": getattr(cv2, "IMWRITE_AVIF_QUALITY", None), ".webp": cv2.IMWRITE_WEBP_QUALITY,
+              ".jpg": cv2.IMWRITE_JPEG_QUALITY}
+    height, width = image.shape[:2]
+
+    def resize(target: int):
+        """Downsizes the frame to the target width, preserving the aspect ratio."""
+        if width <= target:
+            return image
+        return cv2.resize(image, (target, round(height * target / width)), interpolation=cv2.INTER_AREA)
+
+    for target in POSTER_WIDTHS:
+        if target > width and target != POSTER_WIDTHS[0]:
+            continue
+        frame = resize(target)
+        for extension in POSTER_TYPES:
+            if params[extension] is not None and cv2.haveImageWriter(extension):
+                rendition = poster_path(path, target, extension)
+                cv2.imwrite(rendition, frame, [params[extension], POSTER_QUALITY[extension]])
+                written(rendition)
+    cv2.imwrite(path, resize(POSTER_WIDTHS[-1]), [params[".jpg"], POSTER_QUALITY[".jpg"]])
+    written(path)
+
+
+def written(path: str) -> None:
+    """Registers a file created by the server for deletion at shutdown, and drops its cached stat result."""
+    config.static.deletions.add(pathlib.PosixPath(path))
+    statcache.invalidate(path)
+
+
+def preview_path(filepath: pathlib.PosixPath) -> str:
+    """Get the path of the preview image for a video, stored alongside the video.
+
+    Args:
+        filepath: Path of the video file.
+
+    Returns:
+        str:
+        Returns the path of the preview image, which is the JPEG fallback of the poster renditions.
+    """
+    return os.path.join(filepath.parent, f"_{filepath.name.replace(filepath.suffix, '_pys_preview.jpg')}")
+
+
+def poster_path(preview: str, width: int, extension: str) -> str:
+    """Get the path of a poster rendition, stored alongside the preview image.
+
+    Args:
+        preview: Path of the preview image.
+        width: Width of the rendition.
+        extension: File extension of the format.
+
+    Returns:
+        str:
+        Returns the path of the poster rendition.
+    """
+    return f"{os.path.splitext(preview)[0]}_{width}{extension}"
+
+
+def poster_url(path: str) -> str:
+    """Get the URL to load a preview image or a poster rendition.
+
+    Args:
+        path: Path of the image file.
+
+    Returns:
+        str:
+        Returns the URL path served by the preview loader.
+    """
+    return urlparse.quote(f"/{config.static.preview}/{path}")
+
+
+def poster_sources(preview: str) -> List[Dict[str, str]]:
+    """Get the ``srcset`` of the poster renditions in each format, for the browser to pick the right one.
+
+    Args:
+        preview: Path of the preview image.
+
+    Returns:
+        List[Dict[str, str]]:
+        Returns the MIME type and the ``srcset`` for each format that has renditions, in the order of preference.
+    """
+    sources = []
+    for extension, mime in POSTER_TYPES.items():
+        candidates = [f"{poster_url(poster_path(preview, width, extension))} {width}w" for width in POSTER_WIDTHS
+                      if statcache.isfile(poster_path(preview, width, extension))]
+        if candidates:
+            sources.append({"type": mime, "srcset": ", ".join(candidates)})
+    return sources
+
+
+def create_preview(filepath: str) -> bool:
+    """Generates the preview image for a video, unless it already exists.
+
+    Args:
+        filepath: Path of the video file.
+
+    See Also:
+        - Preview images stored before the poster renditions existed are generated again, to add the renditions.
+
+    Returns:
+        bool:
+        Returns a boolean flag to indicate whether the preview image exists.
+    """
+    video = pathlib.PosixPath(filepath)
+    preview = preview_path(video)
+    if statcache.isfile(preview):
+        if statcache.isfile(poster_path(preview, POSTER_WIDTHS[0], ".webp")):
+            return True
+        import cv2
+        if not cv2.haveImageWriter(".webp"):
+            return True
+        logger.info("Adding poster renditions to the preview image of '%s'", video.name)
+    return bool(Images(filepath=video).generate_preview(preview))
+
+
+def generate_in_background(filepath: str) -> None:
+    """Generates the preview image for a video, logging the failures as nobody waits on the result."""
+    try:
+        create_preview(filepath)
+    except Exception as error:
+        logger.error("Failed to generate preview image for '%s': %s", filepath, error)
+    finally:
+        pending.discard(filepath)
+
+
+def schedule_preview(filepath: str) -> None:
+    """Queues the generation of a preview image, to run on a dedicated pool of ``preview_workers`` threads.
+
+    Args:
+        filepath: Path of the video file.
+
+    See Also:
+        - Files already queued are skipped, and in a cluster the item is queued for the node that owns it instead.
+    """
+    global executor
+    if filepath in pending:
+        return
+    if cluster.node and not cluster.node.dispatch("preview", filepath):
+        return
+    with _lock:
+        if filepath in pending:
+            return
+        pending.add(filepath)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=config.env.preview_workers, thread_name_prefix="preview")
+    executor.submit(generate_in_background, filepath)
+
+
+def poster_thumbnails(files: Iterable[str]) -> Dict[str, Optional[str]]:
+    """Get the smallest poster rendition of each video inlined as a data URI, for a grid to load them in one request.
+
+    Args:
+        files: Paths of the video files relative to the video source.
+
+    See Also:
+        - WebP is inlined as it is decoded by all the current browsers, unlike AVIF.
+        - Posters that don't exist yet are queued for generation in the background, and returned as ``None``.
+
+    Returns:
+        Dict[str, Optional[str]]:
+        Returns the data URI of the poster for each file.
+    """
+    source = config.env.video_source.resolve()
+    thumbnails = {}
+    for file in files:
+        video = pathlib.PosixPath(source, file).resolve()
+        if source not in video.parents or not video.is_file():
+            thumbnails[file] = None
+            continue
+        thumbnail = poster_path(preview_path(video), POSTER_WIDTHS[0], ".webp")
+        try:
+            with open(thumbnail, "rb") as image:
+                thumbnails[file] = "data:image/webp;base64," + base64.b64encode(image.read()).decode()
+            config.static.deletions.add(pathlib.PosixPath(thumbnail))
+        except FileNotFoundError:
+            thumbnails[file] = None
+            if config.env.auto_thumbnail:
+                schedule_preview(str(video))
+    return thumbnails
+
+
+_lock = threading.Lock()
+pending: Set[str] = set()
+executor: Optional[ThreadPoolExecutor] = None
@@ -0,0 +1,108 @@
+import mmap
+import threading
+from typing import Dict, Hashable, List
+
+from pystream.logger import logger
+from pystream.models import handles, metrics
+
+
+class SharedMapping:
+    """Read-only memory map of a file, shared by all the streams of the same file and reference counted.
+
+    >>> SharedMapping
+
+    See Also:
+        - Chunks are served as ``memoryview`` slices, so concurrent viewers share the same pages without copies.
+        - Files must not be truncated while they are mapped, reading beyond the new size raises ``SIGBUS``.
+    """
+
+    def __init__(self,
+                 file_handle: handles.Handle,
+                 file_key: Hashable):
+        """Maps the whole file into memory.
+
+        Args:
+            file_handle: Handle of the file to map, the mapping stays valid after the handle is closed.
+            file_key: Unique identifier for the file's content.
+        """
+        self.file_key = file_key
+        self.mmap = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mmap)
+        self.refs = 0
+
+    def slice(self, offset: int, size: int) -> memoryview:
+        """Returns a slice of the mapping, advising the kernel to load the pages ahead of the access.
+
+        Args:
+            offset: Position in the file.
+            size: Number of bytes.
+
+        Returns:
+            memoryview:
+            Returns a view over the mapped bytes.
+        """
+        if hasattr(mmap, "MADV_WILLNEED"):
+            aligned = offset - offset % mmap.PAGESIZE
+            self.mmap.madvise(mmap.MADV_WILLNEED, aligned, min(size + offset - aligned, len(self.mmap) - aligned))
+        return self.view[offset:offset + size]
+
+    def close(self) -> bool:
+        """Closes the mapping, which is not possible until all the slices handed out are released.
+
+        Returns:
+            bool:
+            Returns a boolean flag to indicate whether the mapping was closed.
+        """
+        try:
+            self.view.release()
+            self.mmap.close()
+            return True
+        except BufferError:
+            return False
+
+
+def acquire(file_handle: handles.Handle, file_key: Hashable) -> SharedMapping:
+    """Get the shared mapping for a file, mapping it if it isn't already.
+
+    Args:
+        file_handle: Handle of the file to map.
+        file_key: Unique identifier for the file's content.
+
+    Returns:
+        SharedMapping:
+        Returns the shared mapping with its reference count incremented.
+    """
+    with lock:
+        if (mapping := mappings.get(file_key)) is None:
+            mapping = mappings[file_key] = SharedMapping(file_handle, file_key)
+            metrics.mapped_files.inc()
+        mapping.refs += 1
+        return mapping
+
+
+def release(mapping: SharedMapping) -> None:
+    """Decrements the reference count, and closes the mapping when it is no longer used.
+
+    Args:
+        mapping: Shared mapping acquired for the stream.
+
+    See Also:
+        - Slices could still be held by the server's write buffers, in which case the close is retried on next release.
+    """
+    with lock:
+        mapping.refs -= 1
+        if mapping.refs <= 0:
+            if mappings.get(mapping.file_key) is mapping:
+                del mappings[mapping.file_key]
+                metrics.mapped_files.dec()
+            pending.append(mapping)
+        for stale in pending[:]:
+            if stale.close():
+                pending.remove(stale)
+        if len(pending) > 100:
+            logger.warning("%d memory maps are pending to be closed", len(pending))
+
+
+lock = threading.Lock()
+mappings: Dict[Hashable, SharedMapping] = {}
+pending: List[SharedMapping] = []
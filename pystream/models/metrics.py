@@ -0,0 +1,289 @@
+import bisect
+import collections
+import contextlib
+import threading
+import time
+from typing import (Callable, Dict, Generator, Iterable, List, Optional,
+                    OrderedDict, Tuple)
+
+from pystream.models import config
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def escape(value: str) -> str:
+    """Escape a label value as per the Prometheus text exposition format.
+
+    Args:
+        value: Label value to be escaped.
+
+    Returns:
+        str:
+        Returns the escaped label value.
+    """
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+def format_labels(labelnames: Iterable[str], labelvalues: Iterable[str], extra: str = "") -> str:
+    """Format label names and values into the ``{name="value",...}`` notation.
+
+    Args:
+        labelnames: Names of the labels.
+        labelvalues: Values of the labels.
+        extra: Additional pre-formatted label pair to append.
+
+    Returns:
+        str:
+        Returns the formatted labels, or an empty string when there are no labels.
+    """
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+class Metric:
+    """Base object for all metrics, stores values per label set in a thread safe manner.
+
+    >>> Metric
+
+    See Also:
+        - Values are stored per process, so each worker exposes its own metrics.
+        - Chunk reads, block cache reads and read-ahead run in the threadpool and update metrics there, hence the lock.
+    """
+
+    kind = "untyped"
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 labelnames: Tuple[str, ...] = ()):
+        """Instantiates the metric and registers it to be rendered at the metrics endpoint.
+
+        Args:
+            name: Name of the metric.
+            documentation: Help text for the metric.
+            labelnames: Names of the labels that each sample should be tagged with.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        """Converts the keyword arguments into a tuple of label values in the order of label names."""
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        """Returns the samples for the metric as lines in text format."""
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+    def render(self) -> List[str]:
+        """Returns the help, type and sample lines for the metric."""
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+
+class Counter(Metric):
+    """Monotonically increasing counter, optionally bound to a maximum number of label sets.
+
+    >>> Counter
+
+    See Also:
+        - Label sets beyond ``max_series`` evict the least recently incremented one, which is read as a counter reset
+          by Prometheus if it shows up again.
+    """
+
+    kind = "counter"
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 labelnames: Tuple[str, ...] = (),
+                 max_series: Optional[int] = None):
+        """Instantiates the counter with an optional limit on the number of label sets.
+
+        Args:
+            name: Name of the metric.
+            documentation: Help text for the metric.
+            labelnames: Names of the labels that each sample should be tagged with.
+            max_series: Maximum number of label sets to keep, for labels with unbounded values like file names.
+        """
+        super().__init__(name, documentation, labelnames)
+        self.max_series = max_series
+        self._values: OrderedDict[Tuple[str, ...], float] = collections.OrderedDict()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Increments the counter for the given label set.
+
+        Args:
+            amount: Value to increment by.
+            **labels: Label values for the sample.
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+            if self.max_series:
+                self._values.move_to_end(key)
+                while len(self._values) > self.max_series:
+                    self._values.popitem(last=False)
+
+
+class Gauge(Metric):
+    """Value that can go up and down, optionally computed at scrape time using a callback.
+
+    >>> Gauge
+
+    """
+
+    kind = "gauge"
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 labelnames: Tuple[str, ...] = (),
+                 function: Optional[Callable[[], float]] = None):
+        """Instantiates the gauge with an optional callback.
+
+        Args:
+            name: Name of the metric.
+            documentation: Help text for the metric.
+            labelnames: Names of the labels that each sample should be tagged with.
+            function: Callable that returns the current value, evaluated each time the metric is rendered.
+        """
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """Increments the gauge for the given label set."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        """Decrements the gauge for the given label set."""
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        """Sets the gauge to the given value for the label set."""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self) -> List[str]:
+        """Returns the samples for the gauge, using the callback when available."""
+        if self.function:
+            return [f"{self.name} {self.function()}"]
+        return super().samples()
+
+
+class Histogram(Metric):
+    """Cumulative histogram with a fixed set of buckets.
+
+    >>> Histogram
+
+    """
+
+    kind = "histogram"
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)):
+        """Instantiates the histogram with the upper bounds for each bucket.
+
+        Args:
+            name: Name of the metric.
+            documentation: Help text for the metric.
+            labelnames: Names of the labels that each sample should be tagged with.
+            buckets: Sorted upper bounds of the buckets, ``+Inf`` is added implicitly.
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Records an observation for the given label set.
+
+        Args:
+            value: Value to be observed.
+            **labels: Label values for the sample.
+        """
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if key not in self._counts:
+                self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._counts[key][idx] += 1
+            self._values[key] = self._values.get(key, 0) + value
+
+    @contextlib.contextmanager
+    def time(self, **labels: str) -> Generator[None, None, None]:
+        """Context manager to observe the time taken to execute a block of code."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> List[str]:
+        """Returns the bucket, sum and count samples for each label set."""
+        with self._lock:
+            items = [(key, list(counts), self._values[key]) for key, counts in self._counts.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="%s"' % ("+Inf" if bound == float("inf") else float(bound))
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    """Renders all the registered metrics in Prometheus text exposition format.
+
+    Returns:
+        str:
+        Returns the metrics as a newline separated string.
+    """
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+registry: List[Metric] = []
+
+# Libraries can have a million files, so the file labels are limited to the most recently streamed ones
+bytes_streamed = Counter("pystream_bytes_streamed_total", "Bytes streamed per file and user.", ("file", "user"),
+                         max_series=1_000)
+range_requests = Counter("pystream_range_requests_total", "Range requests served per file.", ("file",),
+                         max_series=1_000)
+range_duration = Histogram("pystream_range_request_seconds", "Time taken to send the requested byte range.")
+active_streams = Gauge("pystream_active_streams", "Number of byte ranges currently being streamed.")
+chunk_read = Histogram("pystream_chunk_read_seconds", "Time taken to read each chunk from disk.",
+                       buckets=(.0001, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1))
+streams_admitted = Counter("pystream_streams_admitted_total", "Streams admitted within the concurrency limits.")
+streams_rejected = Counter("pystream_streams_rejected_total", "Streams rejected as the server was at capacity.")
+streams_queued = Gauge("pystream_streams_queued", "Streams waiting in queue for a free slot.")
+chunk_bytes = Histogram("pystream_chunk_bytes", "Size of the chunks sent, as adapted to each client.",
+                        buckets=tuple(2 ** power for power in range(14, 25)))
+throttle_wait = Histogram("pystream_throttle_wait_seconds", "Time spent waiting on bandwidth limits per chunk.")
+cache_hits = Counter("pystream_cache_hits_total", "Blocks served from the block cache.")
+cache_misses = Counter("pystream_cache_misses_total", "Blocks read from disk as they were not in the block cache.")
+cache_evictions = Counter("pystream_cache_evictions_total", "Blocks evicted from the block cache.")
+cache_bytes = Gauge("pystream_cache_bytes", "Bytes held in the block cache.")
+mapped_files = Gauge("pystream_mapped_files", "Files currently memory mapped for streaming.")
+handle_hits = Counter("pystream_handle_hits_total", "File handles acquired from the pool, for streams and read-ahead.")
+handle_misses = Counter("pystream_handle_misses_total", "File handles that had to be opened (or reopened).")
+read_ahead_bytes = Counter("pystream_read_ahead_bytes_total", "Bytes read ahead based on the playback position.")
+preview_generation = Histogram("pystream_preview_generation_seconds", "Time taken to generate preview images.")
+auth_failures = Counter("pystream_auth_failures_total", "Failed authentication attempts.", ("reason",))
+active_sessions = Gauge("pystream_active_sessions", "Number of users with an active session token.",
+                        function=lambda: len(config.session.mapping))
@@ -0,0 +1,111 @@
+import asyncio
+import os
+import time
+from typing import Hashable, Optional, Tuple
+
+from pystream.logger import logger
+from pystream.models import cache, config, handles, metrics
+
+
+class Playback:
+    """Object to track the playback position of a session, and how far ahead the file has been read.
+
+    >>> Playback
+
+    """
+
+    __slots__ = ("file_path", "offset", "prefetched", "updated")
+
+    def __init__(self, file_path: str):
+        """Instantiates the tracker for a file.
+
+        Args:
+            file_path: Path of the file being streamed.
+        """
+        self.file_path = file_path
+        self.offset = 0
+        self.prefetched = 0
+        self.updated = time.time()
+
+
+def track(session: str, file_path: str, offset: int) -> Optional[Tuple[int, int]]:
+    """Records the last served byte offset for a session, and decides whether the next chunks should be read ahead.
+
+    Args:
+        session: Session identifier, the client's host.
+        file_path: Path of the file being streamed.
+        offset: Byte offset up to which the file has been served.
+
+    See Also:
+        - Seeking backwards, or beyond the read-ahead window, resets the window to the new position.
+        - Read-ahead is issued again only when the player has consumed half of the window.
+
+    Returns:
+        Tuple[int, int]:
+        Returns the offset and length to read ahead, if required.
+    """
+    playback = config.session.playback.get(session)
+    if playback is None or playback.file_path != file_path:
+        playback = config.session.playback[session] = Playback(file_path)
+    playback.offset = offset
+    playback.updated = time.time()
+    window = config.env.read_ahead * config.static.chunk_size
+    if not window:
+        return
+    if offset > playback.prefetched or offset < playback.prefetched - window:
+        playback.prefetched = offset
+    if playback.prefetched - offset >= window // 2:
+        return
+    start = playback.prefetched
+    playback.prefetched = offset + window
+    return start, playback.prefetched - start
+
+
+def prefetch(file_path: str, file_key: Hashable, offset: int, length: int) -> None:
+    """Reads ahead the given range, so that the next range request from the player is served from memory.
+
+    Args:
+        file_path: Path of the file.
+        file_key: Unique identifier for the file's content.
+        offset: Position in the file to start reading from.
+        length: Number of bytes to read ahead.
+
+    See Also:
+        - Uses ``posix_fadvise(WILLNEED)`` to let the kernel pull the pages into page cache asynchronously.
+        - Fills the block cache instead when it is enabled, since those blocks are served without a syscall.
+        - Acquires its own reference on the pooled handle, as the stream can end (and release it) while this runs.
+    """
+    pool = handles.get_pool()
+    try:
+        file_handle = pool.acquire(file_path)
+    except OSError as error:
+        logger.debug("Read-ahead failed for '%s': %s", file_path, error)
+        return
+    try:
+        length = min(length, file_handle.stat.st_size - offset)
+        if length <= 0:
+            return
+        if block_cache := cache.get_cache():
+            block_cache.read(file_handle, file_key, offset, length)
+        elif hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(file_handle.fileno(), offset, length, os.POSIX_FADV_WILLNEED)
+        else:
+            return
+        metrics.read_ahead_bytes.inc(length)
+    except OSError as error:
+        logger.debug("Read-ahead failed for '%s': %s", file_path, error)
+    finally:
+        pool.release(file_handle)
+
+
+def read_ahead(session: str, file_path: str, file_key: Hashable, offset: int) -> None:
+    """Tracks the position and schedules the read-ahead in the background without waiting for it.
+
+    Args:
+        session: Session identifier, the client's host.
+        file_path: Path of the file being streamed.
+        file_key: Unique identifier for the file's content.
+        offset: Byte offset up to which the file has been served.
+    """
+    if window := track(session, file_path, offset):
+        asyncio.get_running_loop().run_in_executor(None, prefetch, file_path, file_key, *window)
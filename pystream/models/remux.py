@@ -0,0 +1,302 @@
+import asyncio
+import json
+import os
+import pathlib
+import shutil
+import subprocess
+import time
+from typing import (AsyncIterable, ByteString, Callable, Dict, List, Optional,
+                    Set, Tuple)
+
+from fastapi import HTTPException, status
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+
+from pystream.logger import logger
+from pystream.models import (admission, cluster, config, metrics, stream,
+                             throttle)
+
+# Codecs that browsers decode within an MP4 container, video is never re-encoded
+VIDEO_CODECS = {"h264", "vp9", "av1"}
+AUDIO_CODECS = {"aac", "mp3", "opus", "flac"}
+
+
+def available() -> bool:
+    """Returns a boolean flag to indicate whether remuxing is configured, and ``ffmpeg`` and ``ffprobe`` are found."""
+    global found
+    if found is None:
+        found = bool(config.env.remux_formats)
+        if found and not (shutil.which(config.env.ffmpeg) and shutil.which(config.env.ffprobe)):
+            logger.warning("'remux_formats' was set, however '%s' or '%s' is not installed",
+                           config.env.ffmpeg, config.env.ffprobe)
+            found = False
+    return found
+
+
+def formats() -> Tuple[str, ...]:
+    """Get the file formats that are listed in the UI, including the ones that are remuxed when it is available."""
+    if available():
+        return tuple(config.env.file_formats) + tuple(config.env.remux_formats)
+    return tuple(config.env.file_formats)
+
+
+def required(file_path: str) -> bool:
+    """Returns a boolean flag to indicate whether the file has to be remuxed for the browsers to play it."""
+    return pathlib.PurePath(file_path).suffix in config.env.remux_formats and available()
+
+
+def cache_path(file_path: str) -> str:
+    """Get the path of the completed remux of a video, stored alongside the video.
+
+    Args:
+        file_path: Path of the video file.
+
+    Returns:
+        str:
+        Returns the path of the remuxed MP4.
+    """
+    video = pathlib.PurePath(file_path)
+    return os.path.join(video.parent, f"_{video.stem}_pys_remux.mp4")
+
+
+def cached(file_path: str) -> Optional[str]:
+    """Get the path of the completed remux of a video, if it exists and is newer than the video.
+
+    Args:
+        file_path: Path of the video file.
+
+    Returns:
+        str:
+        Returns the path of the remuxed MP4.
+    """
+    remuxed = cache_path(file_path)
+    try:
+        if os.stat(remuxed).st_mtime_ns >= os.stat(file_path).st_mtime_ns:
+            return remuxed
+    except FileNotFoundError:
+        pass
+
+
+def probe(file_path: str) -> Tuple[str, Optional[str]]:
+    """Get the codecs of the first video and audio streams, cached by the modified time of the file.
+
+    Args:
+        file_path: Path of the video file.
+
+    Returns:
+        Tuple[str, Optional[str]]:
+        Returns the names of the video and audio codecs, audio being ``None`` when the file has no audio.
+    """
+    key = (file_path, os.stat(file_path).st_mtime_ns)
+    if key in codecs:
+        return codecs[key]
+    output = subprocess.run(
+        [config.env.ffprobe, "-v", "error", "-show_entries", "stream=codec_type,codec_name", "-of", "json", file_path],
+        capture_output=True, check=True, timeout=30
+    ).stdout
+    streams = json.loads(output).get("streams", [])
+    video = next((s.get("codec_name") for s in streams if s.get("codec_type") == "video"), None)
+    audio = next((s.get("codec_name") for s in streams if s.get("codec_type") == "audio"), None)
+    codecs[key] = video, audio
+    return video, audio
+
+
+def command(file_path: str, audio: Optional[str], output: str) -> List[str]:
+    """Get the ``ffmpeg`` command to repackage a video as a fragmented MP4.
+
+    Args:
+        file_path: Path of the video file.
+        audio: Name of the audio codec.
+        output: Path to write to, or ``pipe:1`` for the standard output.
+
+    See Also:
+        - Video is copied as it is, audio is copied as well unless browsers can't decode it, as it's cheap to encode.
+        - Fragments start at keyframes with an empty ``moov`` upfront, so the player can start before it ends.
+
+    Returns:
+        List[str]:
+        Returns the command and its arguments.
+    """
+    return [
+        config.env.ffmpeg, "-nostdin", "-loglevel", "error", "-i", file_path,
+        "-map", "0:v:0", "-map", "0:a:0?", "-c:v", "copy", "-c:a", "copy" if audio in AUDIO_CODECS else "aac",
+        "-sn", "-dn", "-movflags", "frag_keyframe+empty_moov+default_base_moof", "-f", "mp4", output
+    ]
+
+
+def create_remux(file_path: str) -> bool:
+    """Remuxes a video to the cache, unless it already exists.
+
+    Args:
+        file_path: Path of the video file.
+
+    Returns:
+        bool:
+        Returns a boolean flag to indicate whether the remux exists.
+    """
+    if cached(file_path):
+        return True
+    video, audio = probe(file_path)
+    if video not in VIDEO_CODECS:
+        logger.warning("Skipped remuxing '%s', as browsers can't play '%s' video", file_path, video)
+        return False
+    remuxed = cache_path(file_path)
+    partial = remuxed + ".part"
+    try:
+        subprocess.run(command(file_path, audio, partial), capture_output=True, check=True)
+    except subprocess.CalledProcessError as error:
+        logger.error("Failed to remux '%s': %s", file_path, error.stderr.decode(errors="replace").strip())
+        if os.path.isfile(partial):
+            os.remove(partial)
+        return False
+    os.replace(partial, remuxed)
+    config.static.deletions.add(pathlib.PosixPath(remuxed))
+    logger.info("Remuxed '%s' to '%s'", file_path, remuxed)
+    return True
+
+
+def get_semaphore() -> asyncio.Semaphore:
+    """Get the semaphore that caps the number of ``ffmpeg`` processes, created within the running event loop."""
+    global semaphore
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(config.env.max_remuxes)
+    return semaphore
+
+
+async def send_remux(process: asyncio.subprocess.Process,
+                     file_path: str,
+                     file_name: str = "",
+                     username: str = "",
+                     partial: Optional[str] = None,
+                     on_close: Optional[Callable[[], None]] = None) -> AsyncIterable[ByteString]:
+    """Sends the output of ``ffmpeg`` as it is produced, and stores it to the cache if the remux completes.
+
+    Args:
+        process: ``ffmpeg`` process writing the fragmented MP4 to its standard output.
+        file_path: Path of the video file.
+        file_name: Name of the file used to tag the metrics.
+        username: Name of the user streaming the file, used to tag the metrics and apply bandwidth limits.
+        partial: Path to store the output while it is produced, ``None`` to skip caching.
+        on_close: Callback to release the process slot and the admission ticket when the stream ends.
+
+    See Also:
+        - The process is killed if the client disconnects, and the partial output is discarded.
+
+    Yields:
+        ByteString:
+        Bytes as iterable.
+    """
+    buckets = throttle.get_buckets(username)
+    metrics.active_streams.inc()
+    start = time.perf_counter()
+    errors = asyncio.ensure_future(process.stderr.read())
+    completed = False
+    cache_file = None
+    try:
+        if partial:
+            cache_file = await run_in_threadpool(open, partial, "wb")
+        while chunk := await process.stdout.read(config.static.chunk_size):
+            if cache_file:
+                await run_in_threadpool(cache_file.write, chunk)
+            await throttle.consume(buckets, len(chunk))
+            metrics.bytes_streamed.inc(len(chunk), file=file_name, user=username)
+            metrics.chunk_bytes.observe(len(chunk))
+            yield chunk
+        completed = await process.wait() == 0
+        if not completed:
+            logger.error("Failed to remux '%s': %s", file_name, (await errors).decode(errors="replace").strip())
+    finally:
+        if process.returncode is None:
+            process.kill()
+        errors.cancel()
+        if cache_file:
+            cache_file.close()
+            if completed:
+                os.replace(partial, cache_path(file_path))
+                config.static.deletions.add(pathlib.PosixPath(cache_path(file_path)))
+            elif os.path.isfile(partial):
+                os.remove(partial)
+        if on_close:
+            on_close()
+        metrics.active_streams.dec()
+        metrics.range_duration.observe(time.perf_counter() - start)
+
+
+async def remux_response(file_path: str,
+                         username: str = "",
+                         ticket: Optional[admission.Ticket] = None) -> stream.BufferStreamingResponse:
+    """Returns a streaming response with the video repackaged as a fragmented MP4 by ``ffmpeg``.
+
+    Args:
+        file_path: Path of the video file.
+        username: Name of the user requesting the file.
+        ticket: Admission ticket that is released when the stream ends.
+
+    See Also:
+        - The output is not seekable while it is produced, so the ranges are ignored and the whole video is sent.
+        - Once a remux completes, it's cached and served with ranges like any other MP4.
+        - In a cluster, the remux is cached only by the node that owns the file, others just stream it.
+        - Number of ``ffmpeg`` processes is capped by ``max_remuxes``, requests wait in queue for a slot like streams.
+
+    Returns:
+        BufferStreamingResponse:
+        Streaming response from fastapi.
+    """
+    file_name = os.path.relpath(file_path, config.env.video_source)
+    try:
+        video, audio = await run_in_threadpool(probe, file_path)
+    except (subprocess.SubprocessError, ValueError) as error:
+        logger.error("Failed to probe '%s': %s", file_name, error)
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail=f"{file_name!r} is not a video that can be remuxed.")
+    if video not in VIDEO_CODECS:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail=f"Browsers can't play {video!r} video, it has to be transcoded.")
+    slots = get_semaphore()
+    if not await admission.acquire(slots, time.monotonic() + config.env.stream_queue_timeout):
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="Too many videos are being remuxed, please try again.",
+                            headers={"Retry-After": "5"})
+    released = False
+    process = partial = None
+
+    def release() -> None:
+        """Stops the process and releases its slot and the admission ticket, only once for each request."""
+        nonlocal released
+        if not released:
+            released = True
+            # Process is still running if the client disconnected before the response began
+            if process and process.returncode is None:
+                process.kill()
+            if partial:
+                writing.discard(file_path)
+            slots.release()
+            if ticket:
+                ticket.release()
+
+    try:
+        if file_path not in writing and await cluster.dispatch("remux", file_path):
+            writing.add(file_path)
+            partial = cache_path(file_path) + ".part"
+        process = await asyncio.create_subprocess_exec(
+            *command(file_path, audio, "pipe:1"),
+            stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+    except Exception:
+        release()
+        raise
+    logger.info("Remuxing '%s' [%s/%s]", file_name, video, audio)
+    metrics.range_requests.inc(file=file_name)
+    return stream.BufferStreamingResponse(
+        content=send_remux(process=process, file_path=file_path, file_name=file_name, username=username,
+                           partial=partial, on_close=release),
+        headers={"content-type": "video/mp4", "accept-ranges": "none", "cache-control": "no-store"},
+        status_code=status.HTTP_200_OK,
+        background=BackgroundTask(release)
+    )
+
+
+found: Optional[bool] = None
+semaphore: Optional[asyncio.Semaphore] = None
+writing: Set[str] = set()
+codecs: Dict[Tuple[str, int], Tuple[str, Optional[str]]] = {}
@@ -0,0 +1,178 @@
+import asyncio
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from pystream.logger import logger
+from pystream.models import config, remux, statcache
+
+# Positions this close to the start or the end are not worth resuming, the video starts over instead
+MIN_POSITION = 10
+FINISHED = 30
+
+Key = Tuple[str, str]
+Position = Tuple[Optional[float], float]
+
+
+class ResumeStore:
+    """SQLite database of the position where each user stopped watching each file.
+
+    >>> ResumeStore
+
+    See Also:
+        - Positions are written in batches within a single transaction, never from the request that reports them.
+        - A ``None`` position deletes the row, for videos that were watched to the end.
+    """
+
+    def __init__(self, filepath: pathlib.Path):
+        """Opens (or creates) the database.
+
+        Args:
+            filepath: Path of the database file.
+        """
+        self.connection = sqlite3.connect(str(filepath), timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS positions "
+            "(username TEXT NOT NULL, file TEXT NOT NULL, position REAL NOT NULL, updated REAL NOT NULL, "
+            "PRIMARY KEY (username, file))"
+        )
+        self._lock = threading.Lock()
+
+    def get(self, username: str, file: str) -> Optional[float]:
+        """Returns the stored position of the file for the user, ``None`` if there is none."""
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT position FROM positions WHERE username = ? AND file = ?", (username, file)
+            ).fetchone()
+        return row[0] if row else None
+
+    def write(self, batch: Dict[Key, Position]) -> None:
+        """Stores a batch of positions within a single transaction.
+
+        Args:
+            batch: Position and the time it was reported, keyed by the username and the file.
+        """
+        upserts = [(username, file, position, updated)
+                   for (username, file), (position, updated) in batch.items() if position is not None]
+        deletes = [key for key, (position, _) in batch.items() if position is None]
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO positions (username, file, position, updated) VALUES (?, ?, ?, ?)", upserts
+                )
+                self.connection.executemany("DELETE FROM positions WHERE username = ? AND file = ?", deletes)
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+
+def get_store() -> Optional[ResumeStore]:
+    """Get the resume store, opened on first use, ``None`` when ``resume_store`` is not set."""
+    global store
+    if store is None and config.env.resume_store:
+        store = ResumeStore(config.env.resume_store)
+    return store
+
+
+def is_video(file: str) -> bool:
+    """Returns a boolean flag to indicate whether the path is a video within the video source, that is listed in the UI.
+
+    Args:
+        file: Path of the file relative to the video source.
+    """
+    source = config.env.video_source.resolve()
+    video = pathlib.Path(source, file).resolve()
+    return source in video.parents and video.suffix in remux.formats() and statcache.isfile(video)
+
+
+def record(username: str, file: str, position: float, duration: Optional[float] = None) -> None:
+    """Records the position reported by the player in memory, to be written by the next flush.
+
+    Args:
+        username: Name of the user watching the file.
+        file: Path of the file relative to the video source.
+        position: Time in seconds the playback is at.
+        duration: Duration of the video in seconds, if the player knows it.
+    """
+    if not config.env.resume_store:
+        return
+    if position < MIN_POSITION or (duration and position > duration - FINISHED):
+        position = None
+    with _lock:
+        pending[(username, file)] = (position, time.time())
+
+
+async def get_position(username: str, file: str) -> Optional[float]:
+    """Get the position to resume the file at, from the positions yet to be flushed or the database.
+
+    Args:
+        username: Name of the user watching the file.
+        file: Path of the file relative to the video source.
+
+    Returns:
+        float:
+        Returns the time in seconds to start the playback at, ``None`` to start from the beginning.
+    """
+    if not config.env.resume_store:
+        return
+    key = (username, file)
+    with _lock:
+        if key in pending:
+            return pending[key][0]
+        if key in flushing:
+            return flushing[key][0]
+    try:
+        # Database is opened on first use, which creates the file if it doesn't exist
+        return await run_in_threadpool(lambda: get_store().get(username, file))
+    except sqlite3.Error as error:
+        logger.error("Failed to read the resume position: %s", error)
+
+
+def flush() -> int:
+    """Writes the pending positions to the database, returns the number of positions written.
+
+    See Also:
+        - A failed batch is merged back into the pending positions, unless newer positions were reported since.
+    """
+    global pending, flushing
+    if not (resume_store := get_store()):
+        return 0
+    with _lock:
+        if not pending:
+            return 0
+        flushing, pending = pending, {}
+    try:
+        resume_store.write(flushing)
+    except sqlite3.Error as error:
+        logger.error("Failed to store %d resume positions: %s", len(flushing), error)
+        with _lock:
+            pending = {**flushing, **pending}
+        return 0
+    finally:
+        with _lock:
+            written, flushing = flushing, {}
+    logger.debug("Stored %d resume positions", len(written))
+    return len(written)
+
+
+async def maintain() -> None:
+    """Background task to flush the positions periodically, so the heartbeats never wait on the disk."""
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(config.env.resume_flush)
+        try:
+            await loop.run_in_executor(None, flush)
+        except Exception as error:
+            logger.error("Failed to flush the resume positions: %s", error)
+
+
+store: Optional[ResumeStore] = None
+_lock = threading.Lock()
+pending: Dict[Key, Position] = {}
+flushing: Dict[Key, Position] = {}
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import os
+import pathlib
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional
+
+from pystream.logger import logger
+from pystream.models import config, remux
+
+
+class Directory(NamedTuple):
+    """Contents of a directory in the library, as stored in the snapshot.
+
+    >>> Directory
+
+    """
+
+    mtime: int
+    checked: int
+    files: List[str]
+    subdirs: List[str]
+
+
+def visit(relative: str, known: Optional[Directory]) -> Directory:
+    """Lists a directory, reusing its known contents when the directory hasn't been modified since.
+
+    Args:
+        relative: Path of the directory relative to the video source.
+        known: Contents of the directory from the previous scan.
+
+    See Also:
+        - Adding, removing or renaming an entry updates the directory's modified time, so a single ``stat`` is enough
+          to verify the contents, instead of reading the whole directory.
+        - Contents are read again if the directory was modified within 2 seconds of the previous scan, as network
+          filesystems can have a coarse resolution for the modified time.
+        - Uses ``os.scandir``, whose entries carry the file type, so the entries are classified without a ``stat``.
+
+    Returns:
+        Directory:
+        Returns the contents of the directory.
+    """
+    path = os.path.join(config.env.video_source, relative)
+    mtime = os.stat(path).st_mtime_ns
+    if known and known.mtime == mtime and known.checked - mtime > 2e9:
+        return known
+    files, subdirs = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                if not entry.is_symlink():  # Symlinked directories are not followed, same as os.walk
+                    subdirs.append(entry.name)
+            elif entry.name.startswith('_') or entry.name.startswith('.'):
+                continue
+            elif pathlib.PurePath(entry.name).suffix in remux.formats():
+                files.append(entry.name)
+    return Directory(mtime, time.time_ns(), files, subdirs)
+
+
+def scan(previous: Dict[str, Directory]) -> Dict[str, Directory]:
+    """Scans the video source using a pool of threads, where each subdirectory is listed as soon as it is discovered.
+
+    Args:
+        previous: Directories from the previous scan, keyed by the path relative to the video source.
+
+    Returns:
+        Dict[str, Directory]:
+        Returns the directories keyed by the path relative to the video source, the root being an empty string.
+    """
+    started = time.perf_counter()
+    directories = {}
+    reused = 0
+    with ThreadPoolExecutor(max_workers=config.env.scan_workers, thread_name_prefix="scanner") as executor:
+        pending = {executor.submit(visit, "", previous.get("")): ""}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                relative = pending.pop(future)
+                try:
+                    directory = future.result()
+                except OSError as error:
+                    logger.warning("Failed to scan '%s': %s", relative, error)
+                    continue
+                if directory is previous.get(relative):
+                    reused += 1
+                directories[relative] = directory
+                for name in directory.subdirs:
+                    child = os.path.join(relative, name) if relative else name
+                    pending[executor.submit(visit, child, previous.get(child))] = child
+    logger.info("Scanned %d directories in %.2fs, %d were unchanged",
+                len(directories), time.perf_counter() - started, reused)
+    return directories
+
+
+def load() -> bool:
+    """Loads the snapshot of the library stored by the previous run, if it was taken for the same configuration.
+
+    Returns:
+        bool:
+        Returns a boolean flag to indicate whether the snapshot was loaded.
+    """
+    global directories
+    if not config.env.scan_snapshot or not config.env.scan_snapshot.is_file():
+        return False
+    try:
+        with open(config.env.scan_snapshot) as file:
+            snapshot = json.load(file)
+        if snapshot["source"] != str(config.env.video_source) or snapshot["formats"] != list(remux.formats()):
+            logger.info("Ignoring the library snapshot, as it was taken for a different configuration")
+            return False
+        directories = {relative: Directory(*values) for relative, values in snapshot["directories"].items()}
+    except (OSError, ValueError, KeyError, TypeError) as error:
+        logger.warning("Failed to load the library snapshot: %s", error)
+        return False
+    logger.info("Loaded %d directories from the library snapshot", len(directories))
+    return True
+
+
+def save() -> None:
+    """Stores the snapshot of the library, replacing the previous one atomically."""
+    if not config.env.scan_snapshot:
+        return
+    snapshot = {
+        "source": str(config.env.video_source),
+        "formats": list(remux.formats()),
+        "directories": directories
+    }
+    temporary = config.env.scan_snapshot.with_name(config.env.scan_snapshot.name + ".tmp")
+    try:
+        with open(temporary, "w") as file:
+            json.dump(snapshot, file, separators=(",", ":"))
+        os.replace(temporary, config.env.scan_snapshot)
+    except OSError as error:
+        logger.warning("Failed to store the library snapshot: %s", error)
+
+
+def stale(max_age: float) -> bool:
+    """Returns a boolean flag to indicate whether the library wasn't verified within the given number of seconds."""
+    return not scanned or time.monotonic() - checked > max_age
+
+
+def refresh(max_age: Optional[float] = None) -> Dict[str, Directory]:
+    """Scans the library, verifying the known directories by their modified time.
+
+    Args:
+        max_age: Skips the scan if another thread verified the library within these many seconds, while this one
+            waited for it.
+
+    See Also:
+        - Snapshot is stored and the listeners are notified only when a directory has changed.
+
+    Returns:
+        Dict[str, Directory]:
+        Returns the directories in the library.
+    """
+    global directories, scanned, checked
+    with _lock:
+        if max_age is not None and not stale(max_age):
+            return directories
+        previous = directories
+        directories = scan(previous)
+        checked = time.monotonic()
+        first, scanned = not scanned, True
+        if first or directories != previous:
+            save()
+            for listener in listeners:
+                listener()
+    return directories
+
+
+def get_directories() -> Dict[str, Directory]:
+    """Get the directories in the library, verified again when the last scan is older than ``scan_ttl`` seconds.
+
+    See Also:
+        - Verifying costs a ``stat`` for each directory, only the directories that have changed are listed again.
+    """
+    if stale(config.env.scan_ttl):
+        return refresh(config.env.scan_ttl)
+    return directories
+
+
+def files() -> Iterator[str]:
+    """Iterates over the video files that are listed in the UI.
+
+    See Also:
+        - Files directly within a directory that ends with ``__`` are excluded.
+
+    Yields:
+        str:
+        Path of each video file relative to the video source.
+    """
+    for relative, directory in get_directories().items():
+        if os.path.join(config.env.video_source, relative).endswith('__'):
+            continue
+        for file_ in directory.files:
+            yield os.path.join(relative, file_) if relative else file_
+
+
+async def maintain() -> None:
+    """Background task to rescan the library periodically, so that the listings and the search are kept updated."""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, refresh)
+        except Exception as error:
+            logger.error("Failed to scan the library: %s", error)
+        await asyncio.sleep(config.env.scan_interval)
+
+
+directories: Dict[str, Directory] = {}
+scanned = False
+checked = 0.0
+_lock = threading.RLock()
+listeners: List[Callable[[], None]] = []
@@ -0,0 +1,117 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pystream.logger import logger
+from pystream.models import config, scanner
+
+
+class SearchIndex:
+    """In-memory full text index over the names and relative paths of the video files in the library.
+
+    >>> SearchIndex
+
+    See Also:
+        - Uses SQLite's FTS5 with the trigram tokenizer, so any part of a name matches, ranked by ``bm25``.
+        - Falls back to a plain table with ``LIKE`` matching, when the SQLite build doesn't support it.
+        - Terms shorter than 3 characters can't be matched with trigrams, so they're matched with ``LIKE`` as well.
+    """
+
+    def __init__(self, paths: Iterable[str]):
+        """Builds the index.
+
+        Args:
+            paths: Paths of the video files relative to the video source.
+        """
+        self.connection = sqlite3.connect(":memory:", check_same_thread=False)
+        try:
+            self.connection.execute("CREATE VIRTUAL TABLE files USING fts5(name, path, tokenize='trigram')")
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.connection.execute("CREATE TABLE files (name TEXT, path TEXT)")
+            self.fts = False
+        self.connection.executemany(
+            "INSERT INTO files (name, path) VALUES (?, ?)", ((os.path.basename(path), path) for path in paths)
+        )
+        self.connection.commit()
+        self.size = self.connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        self._lock = threading.Lock()
+
+    def search(self, query: str, offset: int, limit: int) -> Tuple[int, List[str]]:
+        """Searches the index for files that match all the terms in the query.
+
+        Args:
+            query: Terms to search for, separated by spaces.
+            offset: Number of results to skip.
+            limit: Maximum number of results to return.
+
+        Returns:
+            Tuple[int, List[str]]:
+            Returns the total number of matches, and the relative paths of the results in the order of relevance.
+        """
+        terms = query.split()
+        if not terms:
+            return 0, []
+        conditions, params = [], []
+        long_terms = [term for term in terms if len(term) >= 3] if self.fts else []
+        if long_terms:
+            conditions.append("files MATCH ?")
+            params.append(" AND ".join('"%s"' % term.replace('"', '""') for term in long_terms))
+        for term in terms:
+            if term not in long_terms:
+                conditions.append("path LIKE ? ESCAPE '\\'")
+                params.append("%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        where = " AND ".join(conditions)
+        # Matches in the name weigh more than the matches in the rest of the path
+        order = "bm25(files, 10.0, 1.0), length(path), path" if long_terms else "length(name), path"
+        with self._lock:
+            total = self.connection.execute(f"SELECT COUNT(*) FROM files WHERE {where}", params).fetchone()[0]
+            rows = self.connection.execute(
+                f"SELECT path FROM files WHERE {where} ORDER BY {order} LIMIT ? OFFSET ?", params + [limit, offset]
+            ).fetchall()
+        return total, [row[0] for row in rows]
+
+
+def refresh(paths: Optional[Iterable[str]] = None) -> SearchIndex:
+    """Builds a new index and swaps it in place of the current one, which continues to serve searches until then.
+
+    Args:
+        paths: Relative paths of the video files, uses the files from the library scan when not provided.
+
+    Returns:
+        SearchIndex:
+        Returns the new index.
+    """
+    global index
+    index = SearchIndex(scanner.files() if paths is None else paths)
+    logger.debug("Indexed %d files for search", index.size)
+    return index
+
+
+def get_index() -> SearchIndex:
+    """Get the search index, built on first use if the library scan hasn't built it yet."""
+    return index or refresh()
+
+
+def search(query: str, page: int, size: int) -> Dict[str, object]:
+    """Searches the library for the video files that match the query.
+
+    Args:
+        query: Terms to search for.
+        page: Page number starting from 1.
+        size: Number of results per page.
+
+    Returns:
+        Dict[str, object]:
+        Returns the page of results along with the total number of matches.
+    """
+    total, paths = get_index().search(query, (page - 1) * size, size)
+    return {
+        "query": query, "page": page, "size": size, "total": total,
+        "results": [{"name": os.path.basename(path), "path": "/" + os.path.join(config.static.stream, path)}
+                    for path in paths]
+    }
+
+
+index: Optional[SearchIndex] = None
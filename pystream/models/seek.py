@@ -0,0 +1,284 @@
+import asyncio
+import bisect
+import struct
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterator, List, Optional, Tuple
+
+from pystream.logger import logger
+from pystream.models import config, handles, playback
+
+# Boxes that only contain other boxes, on the way from 'moov' to the sample tables
+CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+MAX_MOOV = 64 * 1024 * 1024
+
+
+class SeekIndex:
+    """Time and byte offset of each keyframe in the video track of an MP4 file.
+
+    >>> SeekIndex
+
+    See Also:
+        - Built from the sample tables in the ``moov`` box, so the file's media data is never read.
+        - Times are presentation times, with the composition offsets (``ctts``) applied for streams with B-frames.
+        - Edit lists are not applied, so the times can be off by the initial delay of the track, if there is one.
+    """
+
+    __slots__ = ("times", "offsets", "moov")
+
+    def __init__(self, times: List[float], offsets: List[int], moov: Tuple[int, int]):
+        """Instantiates the index.
+
+        Args:
+            times: Presentation time of each keyframe in seconds, in ascending order.
+            offsets: Byte offset of each keyframe.
+            moov: Byte offset and size of the ``moov`` box.
+        """
+        self.times = times
+        self.offsets = offsets
+        self.moov = moov
+
+    def lookup(self, seconds: float) -> Tuple[float, int]:
+        """Get the keyframe at or right before the given time, which the playback has to start from.
+
+        Args:
+            seconds: Time to start the playback at.
+
+        Returns:
+            Tuple[float, int]:
+            Returns the time and the byte offset of the keyframe.
+        """
+        index = max(bisect.bisect_right(self.times, seconds) - 1, 0)
+        return self.times[index], self.offsets[index]
+
+
+def boxes(data: bytes, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[bytes, int, int]]:
+    """Iterates over the boxes within a buffer.
+
+    Args:
+        data: Buffer with the boxes.
+        start: Position of the first box.
+        end: Position where the boxes end.
+
+    Yields:
+        Tuple[bytes, int, int]:
+        Type of the box, and the start and end of its payload.
+    """
+    end = len(data) if end is None else end
+    while start + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", data, start)
+        header = 8
+        if size == 1:
+            size, = struct.unpack_from(">Q", data, start + 8)
+            header = 16
+        elif size == 0:
+            size = end - start
+        if size < header:
+            raise ValueError(f"Invalid size for box {kind!r}")
+        yield kind, start + header, min(start + size, end)
+        start += size
+
+
+def find_moov(file_handle: handles.Handle) -> Tuple[int, int]:
+    """Walks the top level boxes of the file to locate the ``moov`` box, reading only the box headers.
+
+    Args:
+        file_handle: Pooled handle of the file.
+
+    Returns:
+        Tuple[int, int]:
+        Returns the byte offset and size of the ``moov`` box.
+    """
+    offset = 0
+    file_size = file_handle.stat.st_size
+    while offset + 8 <= file_size:
+        header = file_handle.read(offset, 16)
+        size, kind = struct.unpack_from(">I4s", header)
+        if size == 1:
+            size, = struct.unpack_from(">Q", header, 8)
+        elif size == 0:
+            size = file_size - offset
+        if size < 8:
+            break
+        if kind == b"moov":
+            return offset, size
+        offset += size
+    raise ValueError("No 'moov' box was found")
+
+
+def sample_tables(moov: bytes) -> Optional[Dict[bytes, bytes]]:
+    """Get the payload of the sample tables, and the timescale of the video track.
+
+    Args:
+        moov: Payload of the ``moov`` box.
+
+    Returns:
+        Dict[bytes, bytes]:
+        Returns the payload of each box within the video track's ``stbl`` box along with its ``mdhd``.
+    """
+    for kind, start, end in boxes(moov):
+        if kind != b"trak":
+            continue
+        tables: Dict[bytes, bytes] = {}
+
+        def collect(first: int, last: int) -> None:
+            """Collects the boxes within the containers, recursively."""
+            for child, child_start, child_end in boxes(moov, first, last):
+                if child in CONTAINERS:
+                    collect(child_start, child_end)
+                else:
+                    tables[child] = moov[child_start:child_end]
+
+        collect(start, end)
+        # Handler type follows the version, flags and the pre-defined fields
+        if tables.get(b"hdlr", b"")[8:12] == b"vide":
+            return tables
+
+
+def build(file_handle: handles.Handle) -> Optional[SeekIndex]:
+    """Builds the seek index of an MP4 file from the sample tables of its video track.
+
+    Args:
+        file_handle: Pooled handle of the file.
+
+    Returns:
+        SeekIndex:
+        Returns the seek index, or ``None`` if the file has no samples listed, like a fragmented MP4.
+    """
+    moov_offset, moov_size = find_moov(file_handle)
+    if moov_size > MAX_MOOV:
+        raise ValueError(f"'moov' box is too large to index: {moov_size} bytes")
+    moov = file_handle.read(moov_offset, moov_size)
+    _, start, end = next(boxes(moov))
+    tables = sample_tables(moov[start:end])
+    if not tables or b"stts" not in tables:
+        return
+    mdhd = tables[b"mdhd"]
+    timescale, = struct.unpack_from(">I", mdhd, 20 if mdhd[0] == 1 else 12)
+
+    # Decoding time of each sample, from the runs of sample durations
+    times = []
+    elapsed = 0
+    stts = tables[b"stts"]
+    for index in range(struct.unpack_from(">I", stts, 4)[0]):
+        count, delta = struct.unpack_from(">II", stts, 8 + index * 8)
+        times.extend(range(elapsed, elapsed + count * delta, delta) if delta else [elapsed] * count)
+        elapsed += count * delta
+    if not times:
+        return
+
+    # Presentation time of each sample, as the decode order differs from the display order for B-frames
+    if b"ctts" in tables:
+        ctts = tables[b"ctts"]
+        sample = 0
+        for index in range(struct.unpack_from(">I", ctts, 4)[0]):
+            # Offsets are unsigned in version 0, but encoders write negative ones there too, so they're read as signed
+            count, offset = struct.unpack_from(">Ii", ctts, 8 + index * 8)
+            for position in range(sample, min(sample + count, len(times))):
+                times[position] += offset
+            sample += count
+
+    stsz = tables[b"stsz"]
+    sample_size, sample_count = struct.unpack_from(">II", stsz, 4)
+    sizes = [sample_size] * sample_count if sample_size else struct.unpack_from(f">{sample_count}I", stsz, 12)
+    if b"co64" in tables:
+        count, = struct.unpack_from(">I", tables[b"co64"], 4)
+        chunks = struct.unpack_from(f">{count}Q", tables[b"co64"], 8)
+    else:
+        count, = struct.unpack_from(">I", tables[b"stco"], 4)
+        chunks = struct.unpack_from(f">{count}I", tables[b"stco"], 8)
+
+    # Byte offset of each sample, from the chunk offsets and the number of samples in each chunk
+    stsc = tables[b"stsc"]
+    runs = [struct.unpack_from(">III", stsc, 8 + index * 12)[:2]
+            for index in range(struct.unpack_from(">I", stsc, 4)[0])]
+    offsets = []
+    for position, (first_chunk, per_chunk) in enumerate(runs):
+        last_chunk = runs[position + 1][0] if position + 1 < len(runs) else len(chunks) + 1
+        for chunk in range(first_chunk - 1, last_chunk - 1):
+            offset = chunks[chunk]
+            for sample in range(len(offsets), min(len(offsets) + per_chunk, len(sizes))):
+                offsets.append(offset)
+                offset += sizes[sample]
+
+    # Every sample is a keyframe when there is no sync sample table
+    if b"stss" in tables:
+        stss = tables[b"stss"]
+        count, = struct.unpack_from(">I", stss, 4)
+        keyframes = [number - 1 for number in struct.unpack_from(f">{count}I", stss, 8)]
+    else:
+        keyframes = range(len(offsets))
+    keyframes = sorted((max(times[sample], 0) / timescale, offsets[sample])
+                       for sample in keyframes if sample < min(len(times), len(offsets)))
+    if not keyframes:
+        return
+    return SeekIndex(times=[time for time, _ in keyframes],
+                     offsets=[offset for _, offset in keyframes],
+                     moov=(moov_offset, moov_size))
+
+
+def get_index(file_path: str) -> Optional[SeekIndex]:
+    """Get the seek index of a file, built on first use and cached until the file is modified.
+
+    Args:
+        file_path: Path of the file.
+
+    Returns:
+        SeekIndex:
+        Returns the seek index, or ``None`` if the file can't be indexed.
+    """
+    pool = handles.get_pool()
+    file_handle = pool.acquire(file_path)
+    try:
+        key: Hashable = file_handle.key
+        with _lock:
+            if key in indexes:
+                indexes.move_to_end(key)
+                return indexes[key]
+        try:
+            index = build(file_handle)
+        except (ValueError, KeyError, IndexError, struct.error) as error:
+            logger.warning("Failed to build the seek index for '%s': %s", file_path, error)
+            index = None
+        with _lock:
+            indexes[key] = index
+            while len(indexes) > MAX_INDEXES:
+                indexes.popitem(last=False)
+        return index
+    finally:
+        pool.release(file_handle)
+
+
+def warm(file_path: str, seconds: float) -> None:
+    """Reads ahead the ``moov`` box and the keyframe to start from, before the player asks for them.
+
+    Args:
+        file_path: Path of the file.
+        seconds: Time the playback starts at.
+
+    See Also:
+        - Players read the ``moov`` box first, which is at the end of the file unless it was optimized for streaming.
+        - With both in memory, the range requests that follow the first one are served without waiting on the disk.
+    """
+    if not (index := get_index(file_path)):
+        return
+    _, offset = index.lookup(seconds)
+    pool = handles.get_pool()
+    file_handle = pool.acquire(file_path)
+    try:
+        key = file_handle.key
+    finally:
+        pool.release(file_handle)
+    playback.prefetch(file_path, key, *index.moov)
+    playback.prefetch(file_path, key, offset, max(config.env.read_ahead, 1) * config.static.chunk_size)
+
+
+def log_failure(future: asyncio.Future) -> None:
+    """Done callback to log the failure of a warm up that runs in the background, as nobody awaits its result."""
+    if not future.cancelled() and (error := future.exception()):
+        logger.error("Failed to warm up the playback: %s", error)
+
+
+MAX_INDEXES = 256
+_lock = threading.Lock()
+indexes: "OrderedDict[Hashable, Optional[SeekIndex]]" = OrderedDict()
@@ -8,7 +8,7 @@ from fastapi import Request
 from fastapi.templating import Jinja2Templates
 
 from pystream.logger import logger
-from pystream.models import config
+from pystream.models import config, remux, scanner
 
 templates = Jinja2Templates(directory=config.template_storage)
 
@@ -50,39 +50,37 @@ def get_dir_stream_content(parent: pathlib.PosixPath,
 
     Returns:
         List[Dict[str, str]]:
-        A list of dictionaries with filename and the filepath as key-value pairs.
+        A list of dictionaries with filename, the filepath and the path relative to the video source as key-value pairs.
     """
     files = []
+    relative = os.path.relpath(parent, config.env.video_source)
     for file_ in os.listdir(parent):
         if file_.startswith('_') or file_.startswith('.'):
             continue
-        if pathlib.PurePath(file_).suffix in config.env.file_formats:
-            files.append({"name": file_, "path": os.path.join(subdir, file_)})
+        if pathlib.PurePath(file_).suffix in remux.formats():
+            files.append({"name": file_, "path": os.path.join(subdir, file_), "file": os.path.join(relative, file_)})
     return sorted(files, key=lambda x: natural_sort_key(x['name']))
 
 
 def get_all_stream_content() -> Dict[str, List[Dict[str, str]]]:
     """Get video files or folders that contain video files to be streamed.
 
+    See Also:
+        - Served from the library scan, with the directories verified by modified time every ``scan_ttl`` seconds.
+
     Returns:
         Dict[str, List[str]]:
         Dictionary of files and directories with name and path as key-value pairs on each section.
     """
     structure = {'files': [], 'directories': []}
-    for __path, __directory, __file in os.walk(config.env.video_source):
-        if __path.endswith('__'):
+    for path, directory in scanner.get_directories().items():
+        if not directory.files or os.path.join(config.env.video_source, path).endswith('__'):
             continue
-        for file_ in __file:
-            if file_.startswith('_') or file_.startswith('.'):
-                continue
-            if pathlib.PurePath(file_).suffix in config.env.file_formats:
-                if path := __path.replace(str(config.env.video_source), "").lstrip(os.path.sep):
-                    entry = {"name": path, "path": os.path.join(config.static.stream, path)}
-                    if entry in structure['directories']:
-                        continue
-                    structure['directories'].append(entry)
-                else:
-                    structure['files'].append({"name": file_, "path": os.path.join(config.static.stream, file_)})
+        if path:
+            structure['directories'].append({"name": path, "path": os.path.join(config.static.stream, path)})
+        else:
+            structure['files'].extend({"name": file_, "path": os.path.join(config.static.stream, file_), "file": file_}
+                                      for file_ in directory.files)
     return dict(files=sorted(structure['files'], key=lambda x: natural_sort_key(x['name'])),
                 directories=sorted(structure['directories'], key=lambda x: natural_sort_key(x['name'])))
 
@@ -97,11 +95,15 @@ def get_iter(filename: pathlib.PurePath) -> Union[Tuple[str, str], Tuple[None, N
         Tuple[str, str]:
         Tuple of previous file and next file.
     """
-    # Extract only the file formats that are supported
-    dir_content = sorted(
-        (file for file in os.listdir(filename.parent) if pathlib.PosixPath(file).suffix in config.env.file_formats),
-        key=lambda x: natural_sort_key(x)
-    )
+    # Reuse the library index when it has the file, as listing the directory is a round trip on network filesystems
+    relative = os.path.relpath(filename.parent, config.env.video_source)
+    directory = scanner.directories.get("" if relative == "." else relative)
+    if directory and filename.name in directory.files:
+        files = directory.files
+    else:
+        # Extract only the file formats that are supported
+        files = [file for file in os.listdir(filename.parent) if pathlib.PosixPath(file).suffix in remux.formats()]
+    dir_content = sorted(files, key=lambda x: natural_sort_key(x))
     idx = dir_content.index(filename.name)
     if idx > 0:  # 0-1 is -1, which will in turn fetch the last item from the list instead of leaving it blank
         try:
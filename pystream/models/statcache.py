@@ -0,0 +1,96 @@
+import os
+import stat
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple, Union
+
+from starlette.concurrency import run_in_threadpool
+
+from pystream.models import config
+
+Path = Union[str, os.PathLike]
+
+
+def cached(path: Path) -> Tuple[bool, Optional[os.stat_result]]:
+    """Get the stat result of a path from the cache, if it hasn't expired.
+
+    Args:
+        path: Path to look up.
+
+    Returns:
+        Tuple[bool, Optional[os.stat_result]]:
+        Returns a flag to indicate whether the path was in the cache, and its stat result, ``None`` if it didn't exist.
+    """
+    key = os.fspath(path)
+    with _lock:
+        if (entry := entries.get(key)) and time.monotonic() - entry[0] < config.env.sidecar_ttl:
+            entries.move_to_end(key)
+            return True, entry[1]
+    return False, None
+
+
+def probe(path: Path) -> Optional[os.stat_result]:
+    """Get the stat result of a path without the cache, ``None`` if the path doesn't exist."""
+    try:
+        return os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+def stat_path(path: Path) -> Optional[os.stat_result]:
+    """Get the stat result of a path, caching both the result and the absence of the file for ``sidecar_ttl`` seconds.
+
+    Args:
+        path: Path to stat.
+
+    Returns:
+        os.stat_result:
+        Returns the stat result, or ``None`` if the path doesn't exist.
+    """
+    found, result = cached(path)
+    if found:
+        return result
+    result = probe(path)
+    with _lock:
+        entries[os.fspath(path)] = (time.monotonic(), result)
+        while len(entries) > MAX_ENTRIES:
+            entries.popitem(last=False)
+    return result
+
+
+async def lookup(*paths: Path) -> List[Optional[os.stat_result]]:
+    """Get the stat results of several paths, resolving the ones missing in the cache with a single threadpool call.
+
+    Args:
+        *paths: Paths to stat.
+
+    Returns:
+        List[Optional[os.stat_result]]:
+        Returns the stat result of each path, ``None`` for the paths that don't exist.
+    """
+    results = [cached(path) for path in paths]
+    if all(found for found, _ in results):
+        return [result for _, result in results]
+    return await run_in_threadpool(lambda: [stat_path(path) for path in paths])
+
+
+def isfile(path: Path) -> bool:
+    """Returns a boolean flag to indicate whether the path is a regular file, using the cache."""
+    return (result := stat_path(path)) is not None and stat.S_ISREG(result.st_mode)
+
+
+def invalidate(*paths: Path) -> None:
+    """Removes the paths from the cache, when the server creates or removes the files itself.
+
+    Args:
+        *paths: Paths to remove.
+    """
+    with _lock:
+        for path in paths:
+            entries.pop(os.fspath(path), None)
+
+
+MAX_ENTRIES = 16_384
+_lock = threading.Lock()
+entries: "OrderedDict[str, Tuple[float, Optional[os.stat_result]]]" = OrderedDict()
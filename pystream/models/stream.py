@@ -1,32 +1,212 @@
+import asyncio
 import mimetypes
 import os
-from typing import AsyncIterable, BinaryIO, ByteString, Tuple, Union
+import time
+from typing import AsyncIterable, ByteString, Callable, Dict, Optional, Tuple
 
 from fastapi import HTTPException, status
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 
-from pystream.models import config
+from pystream.models import (admission, cache, config, handles, mapped,
+                             metrics, playback, throttle)
 
 
-def send_bytes_range_requests(file_obj: BinaryIO,
-                              start_range: int,
-                              end_range: int) -> AsyncIterable[Union[str, ByteString]]:
+def read_chunk(file_handle: handles.Handle,
+               offset: int,
+               size: int) -> bytes:
+    """Reads a chunk from the file, through the block cache when it is enabled.
+
+    Args:
+        file_handle: Pooled handle of the file to read from.
+        offset: Position in the file to start reading from.
+        size: Number of bytes to read.
+
+    Returns:
+        bytes:
+        Returns the bytes read.
+    """
+    if block_cache := cache.get_cache():
+        return block_cache.read(file_handle, file_handle.key, offset, size)
+    return file_handle.read(offset, size)
+
+
+class ChunkSizer:
+    """Adapts the chunk size of a stream to the throughput measured while sending the previous chunks.
+
+    >>> ChunkSizer
+
+    See Also:
+        - Starts small, so the first bytes reach the player quickly.
+        - Grows (or shrinks) to roughly what the client can receive within ``TARGET_INTERVAL`` seconds.
+        - Bound by ``chunk_size`` and by the memory budget shared across all the active streams.
+    """
+
+    TARGET_INTERVAL = 0.25
+    active = 0
+
+    def __init__(self):
+        """Instantiates the sizer with the minimum chunk size, or the static chunk size when not adaptive."""
+        self.size = config.env.min_chunk_size if config.env.adaptive_chunks else config.static.chunk_size
+
+    @classmethod
+    def limit(cls) -> int:
+        """Returns the maximum chunk size for each stream, as per the memory budget and the number of active streams."""
+        share = config.env.chunk_budget // max(1, cls.active)
+        return max(config.env.min_chunk_size, min(config.static.chunk_size, share))
+
+    def update(self, sent: int, elapsed: float) -> None:
+        """Doubles or halves the chunk size based on the time taken to send the previous chunk.
+
+        Args:
+            sent: Number of bytes sent.
+            elapsed: Time taken to send the bytes.
+        """
+        if not config.env.adaptive_chunks:
+            return
+        target = sent / max(elapsed, 1e-6) * self.TARGET_INTERVAL
+        if target >= self.size * 2:
+            self.size *= 2
+        elif target < self.size // 2:
+            self.size //= 2
+        self.size = max(config.env.min_chunk_size, min(self.size, self.limit()))
+
+
+class BufferStreamingResponse(StreamingResponse):
+    """Streaming response that sends ``memoryview`` chunks as they are, instead of requiring ``bytes``.
+
+    >>> BufferStreamingResponse
+
+    """
+
+    async def stream_response(self, send: Callable) -> None:
+        """Sends the response start and each chunk from the body iterator.
+
+        Args:
+            send: Awaitable callable to send messages.
+        """
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        async for chunk in self.body_iterator:
+            if not isinstance(chunk, (bytes, memoryview)):
+                chunk = chunk.encode(self.charset)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            # Drop the reference to the slice, as the iterator releases the memory map when it ends
+            chunk = None
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+# Interval between the two sizes compared to tell whether a recently modified file is still growing
+LIVE_POLL = 0.5
+
+
+async def is_live(file_path: str) -> bool:
+    """Returns a boolean flag to indicate whether the file is still being written, based on its size growing.
+
+    Args:
+        file_path: Path of the file.
+
+    See Also:
+        - Only files modified within ``live_window`` seconds are checked, others are never delayed.
+        - Size is polled again after ``LIVE_POLL`` seconds, so a file that was just copied or touched is served as a
+          regular file. Files seen growing within ``live_window`` seconds are not polled again.
+
+    Returns:
+        bool:
+        Returns ``True`` if the size of the file grew between two polls.
+    """
+    if not config.env.live_window:
+        return False
+    stat_result = await run_in_threadpool(os.stat, file_path)
+    now = time.monotonic()
+    for path, (_, observed_at) in list(growing.items()):
+        if now - observed_at > config.env.live_window:
+            del growing[path]
+    if time.time() - stat_result.st_mtime >= config.env.live_window:
+        return False
+    size = stat_result.st_size
+    if file_path in growing and size >= growing[file_path][0]:
+        growing[file_path] = (size, now)
+        return True
+    await asyncio.sleep(LIVE_POLL)
+    if (await run_in_threadpool(os.stat, file_path)).st_size > size:
+        growing[file_path] = (size, time.monotonic())
+        return True
+    return False
+
+
+async def send_bytes_range_requests(file_handle: handles.Handle,
+                                    start_range: int,
+                                    end_range: int,
+                                    file_name: str = "",
+                                    username: str = "",
+                                    session: str = "",
+                                    on_close: Optional[Callable[[], None]] = None,
+                                    live: bool = False) -> AsyncIterable[ByteString]:
     """Send a file in chunks using Range Requests specification RFC7233.
 
     Args:
-        file_obj: File data as bytes.
+        file_handle: Pooled handle of the file, shared with the other streams of the same file.
         start_range: Start of range.
         end_range: End of range.
+        file_name: Name of the file used to tag the metrics.
+        username: Name of the user streaming the file, used to tag the metrics and apply bandwidth limits.
+        session: Session identifier used to track the playback position and read ahead.
+        on_close: Callback to release the file handle and the admission ticket when the stream ends.
+        live: Indicates that the file is still being written, so the reads go straight to the file.
+
+    See Also:
+        - Reads are done in a threadpool, so the event loop is free to serve other streams while waiting on disk.
+        - Reads use ``pread`` on the shared handle, so no file position is held per stream.
+        - Each chunk is sent only after the stream, user and global bandwidth limits allow it.
+        - Next few chunks are read ahead in the background, based on the session's playback position.
+        - Chunk size adapts to the rate at which the client receives the chunks.
+        - In ``mmap`` mode, chunks are slices of a memory map shared by all the streams of the file.
+        - In live mode, reads skip the block cache, memory maps and read-ahead, which assume a fixed size.
 
     Yields:
         ByteString:
         Bytes as iterable.
     """
-    with file_obj as streamer:
-        streamer.seek(start_range)
-        while (pos := streamer.tell()) <= end_range:
-            read_size = min(config.static.chunk_size, end_range + 1 - pos)
-            yield streamer.read(read_size)
+    buckets = throttle.get_buckets(username)
+    sizer = ChunkSizer()
+    ChunkSizer.active += 1
+    metrics.active_streams.inc()
+    start = time.perf_counter()
+    mapping = None
+    try:
+        if config.env.stream_mode == "mmap" and start_range <= end_range and not live:
+            mapping = mapped.acquire(file_handle, file_handle.key)
+        pos = start_range
+        while pos <= end_range:
+            read_size = min(sizer.size, end_range + 1 - pos)
+            with metrics.chunk_read.time():
+                if mapping:
+                    chunk = mapping.slice(pos, read_size)
+                elif live:
+                    chunk = await run_in_threadpool(file_handle.read, pos, read_size)
+                else:
+                    chunk = await run_in_threadpool(read_chunk, file_handle, pos, read_size)
+            if not chunk:
+                break
+            await throttle.consume(buckets, len(chunk))
+            metrics.bytes_streamed.inc(len(chunk), file=file_name, user=username)
+            pos += len(chunk)
+            if session and not live:
+                playback.read_ahead(session, file_handle.name, file_handle.key, pos)
+            metrics.chunk_bytes.observe(len(chunk))
+            sent_at = time.perf_counter()
+            yield chunk
+            sizer.update(len(chunk), time.perf_counter() - sent_at)
+    finally:
+        if mapping:
+            chunk = None  # Drop the reference to the last slice, so the mapping can be closed
+            mapped.release(mapping)
+        if on_close:
+            on_close()
+        ChunkSizer.active -= 1
+        metrics.active_streams.dec()
+        metrics.range_duration.observe(time.perf_counter() - start)
 
 
 def get_range_header(range_header: str,
@@ -57,18 +237,45 @@ def get_range_header(range_header: str,
 
 
 def range_requests_response(range_header: str,
-                            file_path: str) -> StreamingResponse:
+                            file_path: str,
+                            username: str = "",
+                            ticket: Optional[admission.Ticket] = None,
+                            session: str = "",
+                            live: bool = False) -> BufferStreamingResponse:
     """Returns StreamingResponse using Range Requests of a given file.
 
     Args:
         range_header: Range values from the headers.
         file_path: Path of the file.
+        username: Name of the user requesting the file.
+        ticket: Admission ticket that is released when the stream ends.
+        session: Session identifier used to track the playback position and read ahead.
+        live: Indicates that the file is still being written, as per ``is_live``.
+
+    See Also:
+        - File handle and its stat result come from a bounded pool, instead of a ``stat`` and ``open`` per request.
+        - Files that are still being written are served up to their current size, with an unknown complete length
+          (``bytes start-end/*``), so the player requests the rest of the file as it grows.
 
     Returns:
-        StreamingResponse:
+        BufferStreamingResponse:
         Streaming response from fastapi.
     """
-    file_size = os.stat(file_path).st_size
+    pool = handles.get_pool()
+    file_handle = pool.acquire(file_path)
+    released = False
+
+    def release() -> None:
+        """Releases the file handle and the admission ticket, only once for each request."""
+        nonlocal released
+        if not released:
+            released = True
+            pool.release(file_handle)
+            if ticket:
+                ticket.release()
+
+    # Pooled stat result can be up to 'stat_ttl' seconds old, which is too old for a growing file
+    file_size = os.fstat(file_handle.fd).st_size if live else file_handle.stat.st_size
     headers = {
         "content-type": mimetypes.guess_type(os.path.basename(file_path), strict=True)[0],
         "accept-ranges": "bytes",
@@ -83,15 +290,33 @@ def range_requests_response(range_header: str,
     end_range = file_size - 1
     status_code = status.HTTP_200_OK
 
-    if range_header:
-        start_range, end_range = get_range_header(range_header=range_header, file_size=file_size)
+    if range_header or live:
+        try:
+            start_range, end_range = get_range_header(range_header=range_header or "bytes=0-", file_size=file_size)
+        except HTTPException:
+            release()
+            raise
         size = end_range - start_range + 1
         headers["content-length"] = str(size)
-        headers["content-range"] = f"bytes {start_range}-{end_range}/{file_size}"
+        headers["content-range"] = f"bytes {start_range}-{end_range}/{'*' if live else file_size}"
         status_code = status.HTTP_206_PARTIAL_CONTENT
 
-    return StreamingResponse(
-        content=send_bytes_range_requests(open(file_path, mode="rb"), start_range, end_range),
+    file_name = os.path.relpath(file_path, config.env.video_source)
+    metrics.range_requests.inc(file=file_name)
+    return BufferStreamingResponse(
+        content=send_bytes_range_requests(file_handle=file_handle,
+                                          start_range=start_range,
+                                          end_range=end_range,
+                                          file_name=file_name,
+                                          username=username,
+                                          session=session,
+                                          on_close=release,
+                                          live=live),
         headers=headers,
         status_code=status_code,
+        # Release the handle and the slot even if the client disconnects before the body iteration begins
+        background=BackgroundTask(release)
     )
+
+
+growing: Dict[str, Tuple[int, float]] = {}
@@ -0,0 +1,91 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from pystream.models import config, metrics
+
+
+class TokenBucket:
+    """Token bucket to limit the bandwidth, refilled at a constant rate up to the burst size.
+
+    >>> TokenBucket
+
+    See Also:
+        - Waiters hold the lock while sleeping, and ``asyncio.Lock`` wakes them up in FIFO order.
+        - So concurrent streams sharing a bucket take turns chunk by chunk, instead of one starving the others.
+    """
+
+    def __init__(self,
+                 rate: int,
+                 burst: Optional[int] = None):
+        """Instantiates the bucket as full.
+
+        Args:
+            rate: Number of bytes allowed per second.
+            burst: Maximum number of bytes that can be sent at once, defaults to a second worth of bytes.
+        """
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def consume(self, amount: int) -> None:
+        """Takes the given number of tokens from the bucket, waiting until the bucket has refilled enough.
+
+        Args:
+            amount: Number of bytes to be sent.
+        """
+        if self._lock is None:  # Created lazily to bind to the running loop
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Chunks larger than the bucket are allowed, the debt is paid off by waiting before the next one
+            self.tokens -= amount
+            if self.tokens < 0:
+                await asyncio.sleep(-self.tokens / self.rate)
+
+
+def get_buckets(username: str) -> List[TokenBucket]:
+    """Get the buckets that apply to a new stream for the given user.
+
+    Args:
+        username: Name of the user streaming the file.
+
+    Returns:
+        List[TokenBucket]:
+        Returns a list of stream, user and global buckets for the limits that are configured.
+    """
+    global total
+    buckets = []
+    if config.env.stream_bandwidth:
+        buckets.append(TokenBucket(config.env.stream_bandwidth))
+    if config.env.user_bandwidth:
+        if username not in users:
+            users[username] = TokenBucket(config.env.user_bandwidth)
+        buckets.append(users[username])
+    if config.env.total_bandwidth:
+        if total is None:
+            total = TokenBucket(config.env.total_bandwidth)
+        buckets.append(total)
+    return buckets
+
+
+async def consume(buckets: List[TokenBucket], amount: int) -> None:
+    """Takes the tokens from each of the buckets, waiting for the slowest one.
+
+    Args:
+        buckets: List of buckets that apply to the stream.
+        amount: Number of bytes to be sent.
+    """
+    if not buckets:
+        return
+    with metrics.throttle_wait.time():
+        for bucket in buckets:
+            await bucket.consume(amount)
+
+
+users: Dict[str, TokenBucket] = {}
+total: Optional[TokenBucket] = None
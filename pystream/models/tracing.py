@@ -0,0 +1,185 @@
+import asyncio
+import contextlib
+import contextvars
+import cProfile
+import os
+import random
+import time
+from typing import Any, Callable, Dict, Generator, List, Optional, Tuple
+
+from pystream.logger import client_host, logger
+from pystream.models import config
+
+spans: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar("spans", default=None)
+
+
+class Profiler:
+    """Object to store the state of the sampling profiler.
+
+    >>> Profiler
+
+    See Also:
+        - Profiling can be turned on/off at runtime by sending ``SIGUSR2`` to the server process.
+        - ``cProfile`` hooks into the whole thread, so only one request is profiled at a time.
+        - Profiling stops when the response starts, so a long stream doesn't profile the requests served alongside it.
+    """
+
+    enabled: bool = False
+    active: bool = False
+
+
+@contextlib.contextmanager
+def span(name: str) -> Generator[None, None, None]:
+    """Records the time taken by a block of code against the current request.
+
+    Args:
+        name: Name of the span, used as the metric name in ``Server-Timing`` header.
+    """
+    recorded = spans.get()
+    if recorded is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorded.append((name, (time.perf_counter() - start) * 1_000))
+
+
+def server_timing(recorded: List[Tuple[str, float]], total: float) -> str:
+    """Constructs the ``Server-Timing`` header value, aggregating spans with the same name.
+
+    Args:
+        recorded: List of span names and their durations in milliseconds.
+        total: Total time taken by the request in milliseconds.
+
+    Returns:
+        str:
+        Returns the header value.
+    """
+    aggregated: Dict[str, float] = {}
+    for name, duration in recorded:
+        aggregated[name] = aggregated.get(name, 0) + duration
+    aggregated["total"] = total
+    return ", ".join(f"{name};dur={duration:.2f}" for name, duration in aggregated.items())
+
+
+def toggle_profiler(*args) -> None:
+    """Signal handler to turn the sampling profiler on or off without restarting the server."""
+    Profiler.enabled = not Profiler.enabled
+    logger.info("Request profiler turned %s", "on" if Profiler.enabled else "off")
+
+
+def start_profiler() -> Optional[cProfile.Profile]:
+    """Starts profiling the current request if the profiler is enabled and the request is sampled.
+
+    Returns:
+        cProfile.Profile:
+        Returns the profiler object if the request is being profiled.
+    """
+    if not Profiler.enabled or Profiler.active or random.random() >= config.env.profile_sample_rate:
+        return
+    Profiler.active = True
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profiler(profiler: cProfile.Profile) -> None:
+    """Stops the profiler, so that another request can be sampled.
+
+    Args:
+        profiler: Profiler object that was started for the request.
+    """
+    profiler.disable()
+    Profiler.active = False
+
+
+def dump_profile(profiler: cProfile.Profile, path: str, elapsed: float) -> None:
+    """Dumps the stats if the request was slower than the threshold, runs in a thread as it writes to the disk.
+
+    Args:
+        profiler: Profiler object that was stopped for the request.
+        path: Path of the request.
+        elapsed: Time taken by the request in milliseconds.
+    """
+    if elapsed < config.env.profile_threshold:
+        return
+    filename = os.path.join(config.env.profile_dir,
+                            f"{time.strftime('%Y%m%d_%H%M%S')}_{path.strip('/').replace('/', '_') or 'root'}.prof")
+    try:
+        os.makedirs(config.env.profile_dir, exist_ok=True)
+        profiler.dump_stats(filename)
+    except OSError as error:
+        logger.error("Failed to store the profile for '%s': %s", path, error)
+        return
+    logger.warning("Request to '%s' took %.2fms, profile stored in '%s'", path, elapsed, filename)
+
+
+class TracingMiddleware:
+    """Middleware to time each request, and the spans recorded within, without buffering the response.
+
+    >>> TracingMiddleware
+
+    See Also:
+        - Adds ``Server-Timing`` header to the response, so the breakdown is visible in the browser's dev tools.
+        - Logs the breakdown when a request is slower than ``slow_request`` milliseconds.
+        - Spans recorded after the response headers are sent (streaming body) are not included in the header.
+        - Sets the client address in the logging context, so that repeated messages can be rate limited per client.
+    """
+
+    def __init__(self, app: Callable):
+        """Instantiates the middleware with the ASGI application.
+
+        Args:
+            app: ASGI application to wrap.
+        """
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        """Records the spans for each HTTP request and attaches the timing information to the response.
+
+        Args:
+            scope: Connection scope.
+            receive: Awaitable callable to receive messages.
+            send: Awaitable callable to send messages.
+        """
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        recorded = []
+        token = spans.set(recorded)
+        client_token = client_host.set(scope["client"][0] if scope.get("client") else None)
+        profiler = start_profiler()
+        profiling = profiler is not None
+        start = time.perf_counter()
+        # Time taken until the response starts, streaming responses can stay open for a long time after that
+        elapsed = None
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            """Adds the ``Server-Timing`` header before the response is started."""
+            nonlocal elapsed, profiling
+            if message["type"] == "http.response.start":
+                elapsed = (time.perf_counter() - start) * 1_000
+                if profiling:
+                    profiling = False
+                    stop_profiler(profiler)
+                if config.env.server_timing:
+                    header = server_timing(recorded, elapsed)
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            spans.reset(token)
+            client_host.reset(client_token)
+            if elapsed is None:
+                elapsed = (time.perf_counter() - start) * 1_000
+            if profiling:
+                stop_profiler(profiler)
+            if profiler:
+                asyncio.get_running_loop().run_in_executor(None, dump_profile, profiler, scope["path"], elapsed)
+            if config.env.slow_request and elapsed >= config.env.slow_request:
+                logger.warning("Slow request '%s' took %.2fms [%s]", scope["path"], elapsed,
+                               server_timing(recorded, elapsed))
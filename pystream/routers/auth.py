@@ -4,9 +4,10 @@ import time
 from fastapi import APIRouter, Cookie, Request, status
 from fastapi.responses import HTMLResponse, JSONResponse
 from jinja2 import Template
+from starlette.concurrency import run_in_threadpool
 
 from pystream.logger import logger
-from pystream.models import authenticator, config, squire
+from pystream.models import authenticator, config, squire, tracing
 
 router = APIRouter()
 
@@ -40,13 +41,17 @@ async def home_page(request: Request,
         Returns the listing page for video streaming.
     """
     squire.log_connection(request)
-    await authenticator.verify_token(session_token)
-    landing_page = squire.get_all_stream_content()
-    return squire.templates.TemplateResponse(
-        name=config.fileio.listing,
-        context={"request": request, "home": config.static.home_endpoint, "logout": config.static.logout_endpoint,
-                 "files": landing_page['files'], "directories": landing_page['directories']},
-    )
+    with tracing.span("auth"):
+        await authenticator.verify_token(session_token)
+    with tracing.span("listing"):
+        landing_page = await run_in_threadpool(squire.get_all_stream_content)
+    with tracing.span("render"):
+        return squire.templates.TemplateResponse(
+            name=config.fileio.listing,
+            context={"request": request, "home": config.static.home_endpoint, "logout": config.static.logout_endpoint,
+                     "search": config.static.search_endpoint, "posters": config.static.posters_endpoint,
+                     "files": landing_page['files'], "directories": landing_page['directories']},
+        )
 
 
 @router.post("%s" % config.static.login_endpoint, response_model=None)
@@ -96,6 +101,7 @@ async def logout(request: Request,
         logout_template: Template = Template(log_file.read())
     if session_token:
         logger.info("%s logged out", request.client.host)
+        config.session.playback.pop(request.client.host, None)
         if config.session.info.get(request.client.host):
             del config.session.info[request.client.host]
         else:
@@ -1,10 +1,12 @@
 import os
 
 from fastapi import APIRouter, Cookie, Request
-from fastapi.responses import FileResponse, HTMLResponse, RedirectResponse
+from fastapi.responses import (FileResponse, HTMLResponse, PlainTextResponse,
+                               RedirectResponse)
 from jinja2 import Template
+from starlette.concurrency import run_in_threadpool
 
-from pystream.models import config, squire
+from pystream.models import authenticator, config, metrics, squire
 
 router = APIRouter()
 
@@ -45,3 +47,28 @@ async def error(detail: str = Cookie(None)) -> HTMLResponse:
         response = HTMLResponse(unauthorized_template)
     response.delete_cookie("detail")
     return response
+
+
+@router.get("%s" % config.static.metrics_endpoint, include_in_schema=False)
+async def metrics_endpoint(request: Request,
+                           session_token: str = Cookie(None)) -> PlainTextResponse:
+    """Exposes the instrumentation metrics in Prometheus text format.
+
+    Args:
+        request: Takes the ``Request`` object as an argument.
+        session_token: Session token set after verifying username and password.
+
+    See Also:
+        - Authenticated via the session cookie when accessed from a browser.
+        - Scrapers can use basic authentication with any of the allowed users instead.
+
+    Returns:
+        PlainTextResponse:
+        Metrics rendered as plain text.
+    """
+    if session_token:
+        await authenticator.verify_token(session_token)
+    else:
+        await authenticator.verify_basic_auth(request)
+    # Rendered in the threadpool, since the session count is read from the shared backend in a cluster
+    return PlainTextResponse(content=await run_in_threadpool(metrics.render), media_type=metrics.CONTENT_TYPE)
@@ -1,15 +1,22 @@
+import asyncio
+import contextlib
 import html
 import os
 import pathlib
-from typing import Optional, Union
+import stat
+from typing import List, Optional, Union
 from urllib import parse as urlparse
 
-from fastapi import APIRouter, Cookie, Header, HTTPException, Request, status
-from fastapi.responses import FileResponse, RedirectResponse, StreamingResponse
+from fastapi import (APIRouter, Body, Cookie, Header, HTTPException, Query,
+                     Request, status)
+from fastapi.responses import (FileResponse, JSONResponse, RedirectResponse,
+                               Response, StreamingResponse)
+from starlette.concurrency import run_in_threadpool
 
 from pystream.logger import logger
-from pystream.models import (authenticator, config, images, squire, stream,
-                             subtitles)
+from pystream.models import (admission, archive, authenticator, cluster,
+                             config, images, remux, resume, search, seek,
+                             squire, statcache, stream, subtitles, tracing)
 
 router = APIRouter()
 
@@ -61,75 +68,234 @@ async def track_loader(request: Request,
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"File at path {track_path!r} does not exist.")
 
 
+@router.get("%s" % config.static.search_endpoint, response_model=None)
+async def search_endpoint(request: Request,
+                          q: str = Query(..., min_length=1, max_length=200),
+                          page: int = Query(1, ge=1),
+                          size: int = Query(50, ge=1, le=500),
+                          session_token: str = Cookie(None)) -> JSONResponse:
+    """Searches the names and paths of the video files in the library.
+
+    Args:
+        request: Takes the ``Request`` object as an argument.
+        q: Terms to search for, separated by spaces.
+        page: Page number of the results.
+        size: Number of results per page.
+        session_token: Token setup for each session.
+
+    Returns:
+        JSONResponse:
+        Returns a page of the results ranked by relevance, along with the total number of matches.
+    """
+    with tracing.span("auth"):
+        await authenticator.verify_token(session_token)
+    squire.log_connection(request)
+    with tracing.span("search"):
+        return JSONResponse(await run_in_threadpool(search.search, q, page, size))
+
+
+@router.post("%s" % config.static.posters_endpoint, response_model=None)
+async def posters_endpoint(request: Request,
+                           files: List[str] = Body(..., embed=True, max_length=100),
+                           session_token: str = Cookie(None)) -> JSONResponse:
+    """Returns the posters for a batch of video files, so that a grid doesn't authenticate a request per tile.
+
+    Args:
+        request: Takes the ``Request`` object as an argument.
+        files: Paths of the video files relative to the video source.
+        session_token: Token setup for each session.
+
+    See Also:
+        - Posters are never generated in the request, the missing ones are queued and returned as ``null``.
+
+    Returns:
+        JSONResponse:
+        Returns the poster of each file as a data URI.
+    """
+    with tracing.span("auth"):
+        await authenticator.verify_token(session_token)
+    squire.log_connection(request)
+    with tracing.span("posters"):
+        return JSONResponse(await run_in_threadpool(images.poster_thumbnails, files))
+
+
+@router.post("%s" % config.static.heartbeat_endpoint, response_model=None)
+async def heartbeat_endpoint(file: str = Body(..., max_length=4096),
+                             position: float = Body(..., ge=0),
+                             duration: Optional[float] = Body(None, ge=0),
+                             session_token: str = Cookie(None)) -> Response:
+    """Records the playback position reported by the player, to resume the video from there on the next visit.
+
+    Args:
+        file: Path of the video file relative to the video source.
+        position: Time in seconds the playback is at.
+        duration: Duration of the video in seconds.
+        session_token: Token setup for each session.
+
+    See Also:
+        - Positions are kept in memory and written to the database in batches, by a background task.
+
+    Raises:
+        HTTPException:
+        404 Not Found if the file is not a video within the video source.
+
+    Returns:
+        Response:
+        Returns an empty response.
+    """
+    auth_payload = await authenticator.verify_token(session_token)
+    if not config.env.resume_store:
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+    if not await run_in_threadpool(resume.is_video, file):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Video {file!r} not found")
+    resume.record(auth_payload.username, file, position, duration)
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+
 @router.get("/%s/{video_path:path}" % config.static.stream, response_model=None)
 async def stream_video(request: Request,
                        video_path: str,
+                       t: Optional[float] = Query(None, ge=0),
                        session_token: str = Cookie(None)) -> squire.templates.TemplateResponse:
     """Returns the template for streaming page.
 
     Args:
         request: Takes the ``Request`` object as an argument.
         video_path: Path of the video file that has to be rendered.
+        t: Time in seconds to start the playback at, defaults to where the user stopped watching.
         session_token: Token setup for each session.
 
     Returns:
         templates.TemplateResponse:
         Returns the listing page for video streaming.
     """
-    await authenticator.verify_token(session_token)
+    with tracing.span("auth"):
+        auth_payload = await authenticator.verify_token(session_token)
     squire.log_connection(request)
     pure_path = config.env.video_source / video_path
-    if pure_path.is_dir():
+    # Requested path is never cached, so the videos added or removed show up right away
+    with tracing.span("stat"):
+        video_stat = await run_in_threadpool(statcache.probe, pure_path)
+    if video_stat and stat.S_ISDIR(video_stat.st_mode):
         # Use only the final dir in the path, since rest of it will be loaded in the login page itself
         # Not doing this will result in redundant path, like /home/GOT/season1/season1/episode1.mp4 resulting in 404
         child_dir = pathlib.Path(video_path).parts[-1]
-        return squire.templates.TemplateResponse(
-            name=config.fileio.listing,
-            context={
-                "request": request,
-                "dir_name": child_dir,  # For GOT/season1/episode1.mp4, this will just display 'season1' in landing page
-                "files": squire.get_dir_stream_content(pure_path, child_dir),
-                "home": config.static.home_endpoint,
-                "logout": config.static.logout_endpoint
-            }
-        )
-    if pure_path.exists():
+        with tracing.span("listing"):
+            files = await run_in_threadpool(squire.get_dir_stream_content, pure_path, child_dir)
+        with tracing.span("render"):
+            return squire.templates.TemplateResponse(
+                name=config.fileio.listing,
+                context={
+                    "request": request,
+                    "dir_name": child_dir,  # For GOT/season1/episode1.mp4, this will display 'season1' in landing page
+                    "files": files,
+                    "home": config.static.home_endpoint,
+                    "logout": config.static.logout_endpoint,
+                    "search": config.static.search_endpoint,
+                    "posters": config.static.posters_endpoint,
+                    "download": urlparse.quote(f"/{config.static.download}/{video_path}")
+                }
+            )
+    if video_stat:
         attrs = {
             "request": request, "video_title": pure_path.name,
             "home": config.static.home_endpoint, "logout": config.static.logout_endpoint,
             "path": f"{config.static.streaming_endpoint}?{config.static.query_param}={urlparse.quote(str(pure_path))}"
         }
-        prev_, next_ = squire.get_iter(pure_path)
+        with tracing.span("iter"):
+            prev_, next_ = await run_in_threadpool(squire.get_iter, pure_path)
+        attrs["file"] = video_path
+        if config.env.resume_store:
+            attrs["heartbeat"] = config.static.heartbeat_endpoint
+        if t is None:
+            with tracing.span("resume"):
+                t = await resume.get_position(auth_payload.username, video_path)
+        if t:
+            # Playback starts at the keyframe before the requested time, as that's where decoding can begin
+            if not remux.required(str(pure_path)):
+                with tracing.span("seek"):
+                    if index := await run_in_threadpool(seek.get_index, str(pure_path)):
+                        t, _ = index.lookup(t)
+            attrs["start"] = round(t, 3)
         if prev_:
             attrs["previous"] = urlparse.quote(prev_)
             attrs["previous_title"] = prev_
         if next_:
             attrs["next"] = urlparse.quote(next_)
             attrs["next_title"] = next_
-        # set default to avoid broken image sign in thumbnail
-        preview_src = os.path.join(pathlib.PurePath(__file__).parent, "blank.jpg")
-        if config.env.auto_thumbnail:
-            # Uses preview file if exists at source, else tries to create one at video_source (reuses when refreshed)
-            pys_preview = os.path.join(pure_path.parent,
-                                       f"_{pure_path.name.replace(pure_path.suffix, '_pys_preview.jpg')}")
-            if os.path.isfile(pys_preview) or images.Images(filepath=pure_path).generate_preview(pys_preview):
-                preview_src = pys_preview
-        attrs['preview'] = urlparse.quote(f"/{config.static.preview}/{preview_src}")
         sfx = pathlib.PosixPath(str(os.path.join(pure_path.parent, pure_path.name.replace(pure_path.suffix, ''))))
         vtt = sfx.with_suffix('.vtt')
         srt = sfx.with_suffix('.srt')
-        if vtt.exists():
+        pys_preview = images.preview_path(pure_path)
+        # Sidecar files are checked together, and served from the stat cache on repeated visits
+        with tracing.span("stat"):
+            preview_stat, vtt_stat, srt_stat = await statcache.lookup(pys_preview, vtt, srt)
+        # set default to avoid broken image sign in thumbnail
+        preview_src = blank = os.path.join(pathlib.PurePath(__file__).parent, "blank.jpg")
+        if config.env.auto_thumbnail:
+            # Uses preview file if exists at source, else tries to create one at video_source (reuses when refreshed)
+            with tracing.span("preview"):
+                # In a cluster, the preview is generated by the node that owns the file, others show the blank image
+                if preview_stat or (await cluster.dispatch("preview", str(pure_path)) and
+                                    await run_in_threadpool(images.create_preview, str(pure_path))):
+                    preview_src = pys_preview
+        attrs['preview'] = images.poster_url(preview_src)
+        if preview_src != blank:
+            attrs['posters'] = await run_in_threadpool(images.poster_sources, preview_src)
+        if vtt_stat:
             attrs['track'] = urlparse.quote(f"/{config.static.track}/{vtt}")
-        elif srt.exists():
+        elif srt_stat:
             logger.info("Converting '%s.srt' to '%s.vtt' for subtitles", sfx.name, sfx.name)
-            await subtitles.srt_to_vtt(srt)
-            if vtt.exists():
+            with tracing.span("subtitles"):
+                await subtitles.srt_to_vtt(srt)
+            statcache.invalidate(vtt)
+            if await run_in_threadpool(statcache.isfile, vtt):
                 config.static.deletions.add(vtt)
                 attrs['track'] = urlparse.quote(f"/{config.static.track}/{vtt}")
-        return squire.templates.TemplateResponse(name=config.fileio.landing, headers=None, context=attrs)
+        with tracing.span("render"):
+            return squire.templates.TemplateResponse(name=config.fileio.landing, headers=None, context=attrs)
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Video file {video_path!r} not found")
 
 
+# noinspection PyShadowingBuiltins
+@router.get("/%s/{dir_path:path}" % config.static.download, response_model=None)
+async def download_directory(request: Request,
+                             dir_path: str,
+                             range: Optional[str] = Header(None),
+                             if_range: Optional[str] = Header(None),
+                             session_token: str = Cookie(None)) -> StreamingResponse:
+    """Downloads a directory as a ZIP archive, generated on the fly without any temporary files.
+
+    Args:
+        request: Takes the ``Request`` object as an argument.
+        dir_path: Path of the directory relative to the video source.
+        range: Header information.
+        if_range: Entity tag of the archive, when a download is resumed.
+        session_token: Token setup for each session.
+
+    See Also:
+        - Files are stored without compression, as videos don't compress any further.
+
+    Returns:
+        StreamingResponse:
+        Streams the archive, or the requested range of it.
+    """
+    with tracing.span("auth"):
+        auth_payload = await authenticator.verify_token(session_token)
+    squire.log_connection(request)
+    source = config.env.video_source.resolve()
+    directory = pathlib.Path(source, dir_path).resolve()
+    if source != directory and source not in directory.parents or not directory.is_dir():
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Directory {dir_path!r} not found")
+    with tracing.span("layout"):
+        layout = await run_in_threadpool(archive.Layout, directory)
+    logger.info("Downloading: %s [%d files]", dir_path or directory.name, len(layout.entries))
+    with tracing.span("admission"):
+        ticket = await admission.admit(auth_payload.username)
+    return archive.archive_response(layout=layout, file_name=f"{directory.name}.zip", range_header=range,
+                                    if_range=if_range, username=auth_payload.username, ticket=ticket)
+
+
 # noinspection PyShadowingBuiltins
 @router.get("%s" % config.static.streaming_endpoint, response_model=None, include_in_schema=False)
 async def video_endpoint(request: Request,
@@ -146,7 +312,8 @@ async def video_endpoint(request: Request,
         Union[RedirectResponse, StreamingResponse]:
         Streams the video name received as cookie.
     """
-    await authenticator.verify_token(session_token)
+    with tracing.span("auth"):
+        auth_payload = await authenticator.verify_token(session_token)
     squire.log_connection(request)
     if not range or not range.startswith("bytes"):
         logger.info("/video endpoint accessed directly. Redirecting to login page.")
@@ -158,7 +325,33 @@ async def video_endpoint(request: Request,
     if config.session.info.get(request.client.host) != request.query_params[config.static.query_param]:
         config.session.info[request.client.host] = request.query_params[config.static.query_param]
         logger.info("Streaming: %s", request.query_params[config.static.query_param])
-    return stream.range_requests_response(
-        range_header=range,
-        file_path=os.path.join(config.env.video_source, request.query_params[config.static.query_param])
-    )
+    with tracing.span("admission"):
+        ticket = await admission.admit(auth_payload.username)
+    file_path = os.path.join(config.env.video_source, request.query_params[config.static.query_param])
+    try:
+        if remux.required(file_path):
+            # Completed remuxes are served with ranges like any other MP4, until then the video is remuxed on the fly
+            if remuxed := await run_in_threadpool(remux.cached, file_path):
+                file_path = remuxed
+            else:
+                with tracing.span("remux"):
+                    return await remux.remux_response(file_path=file_path, username=auth_payload.username,
+                                                      ticket=ticket)
+        # Player's first request is from the start of the file, and the requests for the start time follow it
+        with contextlib.suppress(ValueError):
+            if range.startswith("bytes=0-") and (start := float(request.query_params.get("t", 0))) > 0:
+                warming = asyncio.get_running_loop().run_in_executor(None, seek.warm, file_path, start)
+                warming.add_done_callback(seek.log_failure)
+        with tracing.span("stream"):
+            live = await stream.is_live(file_path)
+            return stream.range_requests_response(
+                range_header=range,
+                file_path=file_path,
+                username=auth_payload.username,
+                ticket=ticket,
+                session=request.client.host,
+                live=live
+            )
+    except Exception:
+        ticket.release()
+        raise
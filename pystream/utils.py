@@ -1,8 +1,6 @@
 import socket
 from ipaddress import IPv4Address
 
-import requests
-
 
 def get_local_ip() -> IPv4Address:
     """Uses simple check on network id to retrieve the local IP address.
@@ -23,4 +21,5 @@ def get_public_ip() -> IPv4Address:
         IPv4Address:
         Public IP address of host machine's connection.
     """
+    import requests  # Imported only when required, as it is not needed to run the server
     return IPv4Address(requests.get('https://checkip.amazonaws.com').text.strip())